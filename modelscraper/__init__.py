@@ -1,5 +1,7 @@
-from .sources import WebSource, BrowserSource, ModuleSource, ProgramSource, APISource
+from .sources import WebSource, AsyncWebSource, BrowserSource, ModuleSource, ProgramSource, APISource
 from .databases import MongoDB, ShellCommand, CSV, Sqlite, File, InfluxDB
 from .parsers import HTMLParser, JSONParser, CSVParser, TextParser
 from .selectors import TextSelector, JavascriptVarSelector, ORCSSSelector, SliceSelector
 from .components import Model, Attr, Scraper
+from .urls import UrlPattern, PageRange
+from .frontiers import SeenFilter, SqliteSeen
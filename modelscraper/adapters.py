@@ -0,0 +1,113 @@
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+import requests
+
+
+class CachedDNSConnection(object):
+    '''
+    A mixin for the connections of urllib3, which connects to the addresses of
+    the host in the DNS cache of the adapter instead of resolving the host for
+    each new connection.
+    '''
+    adapter = None
+
+    def _new_conn(self):
+        dns_cache = self.adapter.dns_cache
+        addresses = dns_cache.resolve(self._dns_host) if dns_cache else None
+        if not addresses:
+            return super()._new_conn()
+
+        # The host is only replaced while the socket is opened, the Host
+        # header and the TLS server name still use the host. Each address is
+        # tried in turn, since a host might not listen on all of them, for
+        # example on the IPv6 address of localhost.
+        host = self._dns_host
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as connection_error:
+                    error = connection_error
+            raise error
+        finally:
+            self._dns_host = host
+
+
+class PoolingAdapter(HTTPAdapter):
+    '''
+    An HTTPAdapter which keeps a pool of "pool_size" connections for each
+    host, so every worker of a source can keep its own connection alive. It
+    keeps track of how often the connections in its pools are reused.
+    '''
+
+    def __init__(self, pool_size=10, hosts=10, dns_cache=None, **kwargs):
+        '''
+        Parameters
+        ----------
+        pool_size : int, optional
+                    The maximum amount of connections kept alive for each
+                    host.
+
+        hosts : int, optional
+                The amount of hosts for which a pool of connections is kept.
+
+        dns_cache : DNSCache, optional
+                    The cache used to resolve the hosts of new connections.
+        '''
+        self.dns_cache = dns_cache
+        self.closed_connections = 0
+        self.closed_requests = 0
+        super().__init__(pool_connections=hosts, pool_maxsize=pool_size,
+                         **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': self._pool_class(HTTPConnectionPool),
+            'https': self._pool_class(HTTPSConnectionPool)}
+        # Keep the counts of the pools which are discarded when more hosts
+        # are visited than there are pools.
+        self.poolmanager.pools.dispose_func = self._dispose_pool
+
+    def _pool_class(self, pool_class):
+        connection_class = type(
+            pool_class.ConnectionCls.__name__,
+            (CachedDNSConnection, pool_class.ConnectionCls), {'adapter': self})
+        return type(pool_class.__name__, (pool_class,),
+                    {'ConnectionCls': connection_class})
+
+    def _dispose_pool(self, pool):
+        self.closed_connections += pool.num_connections
+        self.closed_requests += pool.num_requests
+        pool.close()
+
+    def stats(self):
+        '''
+        Returns the amount of connections that were opened and the amount of
+        requests that were made over them. Every request above the amount of
+        connections reused a kept alive connection.
+        '''
+        pools = self.poolmanager.pools
+        connections, made = self.closed_connections, self.closed_requests
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool:
+                connections += pool.num_connections
+                made += pool.num_requests
+        return {'connections': connections, 'requests': made,
+                'reused': max(made - connections, 0)}
+
+
+def pooled_session(pool_size=10, hosts=10, dns_cache=None):
+    '''
+    Returns a requests.Session which uses a PoolingAdapter for both http and
+    https urls.
+    '''
+    session = requests.Session()
+    adapter = PoolingAdapter(pool_size=pool_size, hosts=hosts,
+                             dns_cache=dns_cache)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
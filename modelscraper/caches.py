@@ -0,0 +1,249 @@
+from threading import Lock
+import ipaddress
+import json
+import socket
+import time
+
+
+class HTTPCache(object):
+    '''
+    A cache for the responses retrieved by a WebSource, stored on disk with
+    diskcache. Responses younger than the ttl are served from the cache.
+    Older responses are revalidated with a conditional request using their
+    ETag and Last-Modified headers, so an unchanged page only costs a 304
+    response.
+
+    Attributes
+    ----------
+    hits : int
+        The amount of responses served from the cache without a request.
+
+    revalidated : int
+        The amount of responses served from the cache after a 304 response.
+
+    misses : int
+        The amount of responses that had to be downloaded.
+    '''
+
+    def __init__(self, directory='/tmp/modelscraper_cache', ttl=3600,
+                 size_limit=2 ** 30):
+        '''
+        Parameters
+        ----------
+        directory : str, optional
+                    The directory in which the responses are stored.
+
+        ttl : int, optional
+              The amount of seconds a response is served without
+              revalidating it.
+
+        size_limit : int, optional
+                     The maximum size of the cache in bytes. The least
+                     recently used responses are evicted first.
+        '''
+        from diskcache import Cache
+
+        self.cache = Cache(directory, size_limit=size_limit,
+                           eviction_policy='least-recently-used')
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def key(self, method, url, kwargs):
+        # The headers are not part of the key, since the User-Agent header
+        # is random by default.
+        return json.dumps([method, url, kwargs.get('params'),
+                           kwargs.get('data')], sort_keys=True, default=str)
+
+    def lookup(self, key):
+        '''
+        Returns the stored entry for the key and whether it is fresh enough
+        to be used without a request.
+        '''
+        entry = self.cache.get(key)
+        if entry and time.time() - entry['stored'] < self.ttl:
+            self.count('hits')
+            return entry, True
+        return entry, False
+
+    def conditional_headers(self, entry, kwargs):
+        '''
+        Returns the kwargs with the headers for a conditional request added.
+        '''
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        if not headers:
+            return kwargs
+        return {**kwargs, 'headers': {**kwargs.get('headers', {}), **headers}}
+
+    def revalidate(self, key, entry):
+        self.count('revalidated')
+        entry['stored'] = time.time()
+        self.cache.set(key, entry)
+        return entry['body']
+
+    def store(self, key, body, response):
+        self.count('misses')
+        self.cache.set(key, {'body': body,
+                             'etag': response.headers.get('ETag'),
+                             'last_modified': response.headers.get(
+                                 'Last-Modified'),
+                             'stored': time.time()})
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        return {'hits': self.hits, 'revalidated': self.revalidated,
+                'misses': self.misses, 'size': self.cache.volume()}
+
+
+class DNSCache(object):
+    '''
+    A cache of the addresses of hosts, which keeps each address for the TTL
+    of its DNS record. Hosts that cannot be resolved are cached as dead for
+    "negative_ttl" seconds, so the urls of a dead host can be dropped without
+    looking it up again. The hosts in the hosts file are resolved to the
+    addresses listed there, as the system resolver would do.
+    '''
+
+    def __init__(self, negative_ttl=300, min_ttl=30, lifetime=5,
+                 hosts_file='/etc/hosts'):
+        '''
+        Parameters
+        ----------
+        negative_ttl : int, optional
+                       The amount of seconds a host that could not be resolved
+                       is considered dead.
+
+        min_ttl : int, optional
+                  The minimum amount of seconds an address is cached, even if
+                  the TTL of its record is shorter.
+
+        lifetime : float, optional
+                   The amount of seconds a lookup may take before the host is
+                   considered dead.
+
+        hosts_file : str, optional
+                     The hosts file whose hosts are not looked up in the DNS.
+        '''
+        import dns.resolver
+
+        self.dns = dns
+        self.resolver = dns.resolver.Resolver()
+        self.resolver.lifetime = lifetime
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.entries = {}
+        self.hosts = self.read_hosts(hosts_file) if hosts_file else {}
+        self.lookups = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def read_hosts(filename):
+        '''
+        Returns the addresses of each host in the hosts file, in the order in
+        which they are listed.
+        '''
+        hosts = {}
+        try:
+            with open(filename) as fle:
+                for line in fle:
+                    fields = line.split('#', 1)[0].split()
+                    if len(fields) < 2:
+                        continue
+                    try:
+                        address = str(ipaddress.ip_address(
+                            fields[0].split('%', 1)[0]))
+                    except ValueError:
+                        continue
+                    for host in fields[1:]:
+                        addresses = hosts.setdefault(host.lower(), [])
+                        if address not in addresses:
+                            addresses.append(address)
+        except OSError:
+            pass
+        return hosts
+
+    def resolve(self, host):
+        '''
+        Returns the addresses of the host, or an empty list if the host could
+        not be resolved. If the lookup timed out, None is returned and nothing
+        is cached, so the host is looked up again the next time.
+        '''
+        try:
+            return [str(ipaddress.ip_address(host))]
+        except ValueError:
+            pass
+
+        addresses = self.hosts.get(host.lower().rstrip('.'))
+        if addresses:
+            return addresses
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(host)
+        if entry and entry[1] > now:
+            return entry[0]
+
+        addresses, ttl = self.query(host)
+        with self.lock:
+            self.lookups += 1
+            if addresses is not None:
+                self.entries[host] = (addresses, now + ttl)
+        return addresses
+
+    def query(self, host):
+        resolver = self.dns.resolver
+        timed_out = False
+        # Hosts without an A record might only have an IPv6 address.
+        for record_type in ('A', 'AAAA'):
+            try:
+                answer = self.resolver.resolve(host, record_type)
+                return ([record.address for record in answer],
+                        max(answer.rrset.ttl, self.min_ttl))
+            except resolver.NoAnswer:
+                continue
+            except self.dns.exception.Timeout:
+                timed_out = True
+                break
+            except (resolver.NXDOMAIN, resolver.NoNameservers):
+                break
+
+        # Hosts of the local network might only be known to the system
+        # resolver.
+        try:
+            infos = socket.getaddrinfo(host, None, socket.AF_UNSPEC,
+                                       socket.SOCK_STREAM)
+            return list(dict.fromkeys(info[4][0] for info in infos)), \
+                self.min_ttl
+        except socket.gaierror as error:
+            # A timeout is not a reason to consider the host dead.
+            if timed_out or error.errno == socket.EAI_AGAIN:
+                return None, 0
+            return [], self.negative_ttl
+        except UnicodeError:
+            return [], self.negative_ttl
+
+    def is_dead(self, host):
+        '''
+        Returns True if the host could not be resolved the last time it was
+        looked up. The host is not looked up again.
+        '''
+        with self.lock:
+            entry = self.entries.get(host)
+        return bool(entry and not entry[0] and entry[1] > time.monotonic())
+
+    def stats(self):
+        with self.lock:
+            dead = sum(1 for addresses, expires in self.entries.values()
+                       if not addresses)
+            return {'lookups': self.lookups, 'hosts': len(self.entries),
+                    'dead': dead}
@@ -1,23 +1,26 @@
-from collections import defaultdict, Counter
+from collections import defaultdict, deque, Counter
 from copy import copy
 from datetime import datetime
-from io import BytesIO
 from threading import BoundedSemaphore
 from queue import Empty, Queue
 from threading import Thread, Lock
-from zipfile import ZipFile
 
+import asyncio
 import inspect
 import logging
+import multiprocessing
+import os
+import pickle
 import pprint
 import re
 import time
 import types
 
-from pybloom_live import ScalableBloomFilter
-
 from .helpers import wrap_list, get_name, \
-    add_other_doc, get_next
+    add_other_doc, get_next, decompress
+from .frontiers import SeenFilter, SqliteQueue, SqliteSeen
+from .limiters import DomainRateLimiter
+from .urls import UrlPattern
 
 
 pp = pprint.PrettyPrinter(indent=4)
@@ -80,10 +83,15 @@ class BaseComponent(object):
 
 class BaseSource(object):
     kwargs = []
+    # The amount of seconds of work the feeder keeps in the in_q and the
+    # amount of seconds it sleeps when the in_q is full enough.
+    prefetch = 2
+    feed_interval = 0.05
 
     def __init__(self, name='', attrs=[], url_template='{}', url_regex='',
                  urls=[], func='', test_urls=[], n_workers=1, compression='',
-                 kwargs_format={}, duplicate=False, debug=False):
+                 kwargs_format={}, duplicate=False, debug=False,
+                 frontier='', split_members=False, chunk_size=0, seen=None):
         '''
         Parameters
         ----------
@@ -117,8 +125,18 @@ class BaseSource(object):
             Source
 
         compression : string, optional
-            The compression type used for the data retrieved from each URL. At
-            the moment only Zip and Gzip are supported
+            The compression type used for the data retrieved from each URL.
+            Either "zip", "gzip", "bz2" or "xz".
+
+        split_members : bool, optional
+            If True, each member of a compressed archive is parsed as a
+            separate item instead of the members being joined together.
+
+        chunk_size : int, optional
+            If set, the data is parsed in chunks of about this amount of
+            bytes, which end at a newline. Use it for large CSV or text files,
+            so they are not held in memory at once. The members of compressed
+            data are decompressed in chunks as well.
 
         kwargs_format : dict, optional
             A mapping which tells the source to str.format a value of an attr
@@ -135,6 +153,17 @@ class BaseSource(object):
             >>> # value of the category Attr as the value used in the "params"
             >>> # kwarg.
 
+        frontier : string, optional
+            The filename of an Sqlite database in which the urls that still
+            have to be retrieved and the urls that have been seen are stored.
+            If the Scraper crashes or is stopped, the source resumes from the
+            urls in this database the next time it is started.
+
+        seen : SeenFilter, optional
+            The urls that were seen by the source, which are not retrieved
+            again. By default the canonicalized urls are stored exactly in a
+            temporary Sqlite database on disk, with a bloom filter in memory
+            to avoid most lookups in the database.
         '''
         self.attrs = attrs
         self.compression = compression
@@ -146,6 +175,8 @@ class BaseSource(object):
         self.url_template = url_template
         self.urls = urls
         self.debug = debug
+        self.split_members = split_members
+        self.chunk_size = chunk_size
 
         # Compile the url_regex
         self.url_regex = re.compile(url_regex).search if url_regex else False
@@ -159,12 +190,28 @@ class BaseSource(object):
         self.in_q = Queue()
         self.lock = Lock()
         self.out_q = Queue()
-        self.seen = ScalableBloomFilter()
+        self.parsing = 0
+        self.ready = None
+        self.seen = seen if seen is not None else SeenFilter()
         self.to_parse = 0
         self.upstream_sources = []
         self.url_amount = int((self.n_workers / 2) + 10)
+        self.feeder = None
+        self.patterns = deque()
         self.url_attrs = defaultdict(dict)
         self.models = []
+        self.frontier = ''
+        if frontier:
+            self.use_frontier(frontier)
+
+    def use_frontier(self, filename):
+        '''
+        Store the urls to retrieve and the urls that were seen in an Sqlite
+        database instead of in memory.
+        '''
+        self.frontier = filename
+        self.in_q = SqliteQueue(filename)
+        self.seen = SeenFilter(SqliteSeen(filename))
 
     @property
     def semaphore(self):
@@ -194,6 +241,16 @@ class BaseSource(object):
         return any(w.retrieving for w in self.workers)
 
     def start(self):
+        # The lists of urls, attrs and kwargs are consumed from the left, a
+        # deque does that in constant time and releases each consumed value.
+        for key in ('urls', 'attrs', *self.kwargs):
+            value = getattr(self, key, None)
+            if type(value) in (list, tuple):
+                setattr(self, key, deque(value))
+
+        # The urls which were left in a frontier by a previous run still have
+        # to be parsed.
+        self.to_parse += self.in_q.qsize()
         self.workers = [
             self.source_worker(parent=self, id=1, in_q=self.in_q,
                                out_q=self.out_q, semaphore=self._semaphore,
@@ -203,6 +260,49 @@ class BaseSource(object):
         for worker in self.workers:
             worker.start()
 
+        with self.lock:
+            if self.urls or self.patterns:
+                self.start_feeder()
+
+    def start_feeder(self):
+        # Called while holding the lock.
+        self.feeder = Thread(target=self.feed, daemon=True)
+        self.feeder.start()
+
+    def feed(self):
+        '''
+        Keeps enough urls in the in_q to keep the workers busy, until all the
+        urls of the source have been put in the in_q. It runs in its own
+        Thread, so the workers do not wait for the data to be parsed.
+        '''
+        while True:
+            with self.lock:
+                if not self.urls and not self.patterns:
+                    self.feeder = None
+                    break
+            missing = self.target_depth() - self.in_q.qsize()
+            # Wait when the in_q is full enough, or when the patterns of the
+            # source are waiting for their pages to be parsed.
+            if missing <= 0 or not self.consume(missing):
+                time.sleep(self.feed_interval)
+        # The source might be done if none of the urls had to be retrieved.
+        self.notify()
+
+    def target_depth(self):
+        '''
+        Returns the amount of urls the in_q should contain, which is the
+        amount of urls the workers retrieve in "prefetch" seconds, based on
+        the mean retrieval time of each worker. A source which retrieves its
+        urls in batches, like the APISource, needs enough urls to fill a
+        batch for each worker.
+        '''
+        concurrency = getattr(self, 'concurrency', 1)
+        batch_size = getattr(self, 'batch_size', 1)
+        throughput = sum(concurrency * batch_size / worker.mean
+                         for worker in self.workers if worker.mean)
+        return max(self.url_amount, batch_size * self.n_workers,
+                   int(throughput * self.prefetch))
+
     @classmethod
     def from_db(cls, database, table='', url='url', query={}, **kwargs):
         for obj in database.read(table=table, query=query):
@@ -214,17 +314,27 @@ class BaseSource(object):
             for v in values:
                 yield cls(url=v, **kwargs)
 
-    def get_source(self):
+    def get_source(self, block=True):
+        '''
+        Returns the next (url, attrs, data) retrieved by the workers, None if
+        nothing was retrieved and False when the source has stopped. If block
+        is True, it waits at most a second for the workers.
+        '''
         assert self.workers, "No workers have been started, call \
             'initialize_workers'"
-        self.consume()
 
         try:
-            url, data, attrs = self.out_q.get(timeout=1)
+            url, data, attrs = self.out_q.get(block=block, timeout=1)
             self.out_q.task_done()
-            self.to_parse -= 1
+            with self.lock:
+                self.to_parse -= 1
             if data is None:
                 logging.log(logging.WARNING, str(url) + 'no data was returned')
+                self.parsed(url, 0)
+                return None
+            # The url was put back in the in_q to be retried, it is reported
+            # as parsed once the data of the retry is parsed.
+            if data is False:
                 return None
             return url, attrs, data
         except Empty:
@@ -233,6 +343,12 @@ class BaseSource(object):
                 return False
 
     def _should_terminate(self):
+        if self.parsing:
+            return False
+        # The feeder takes the lock while it moves urls to the in_q.
+        with self.lock:
+            if self.urls or self.patterns:
+                return False
         if not self.upstream_sources and not self.to_parse \
                 and not self.retrieving():
             return True
@@ -242,52 +358,133 @@ class BaseSource(object):
             return True
         return False
 
+    def notify(self):
+        '''
+        Tells the Scraper that this source has to be checked, either because
+        data was retrieved or because it might be done.
+        '''
+        if self.ready is not None:
+            self.ready.put(self)
+
     def stop(self):
         for worker in self.workers:
             self.in_q.put(None)
         for worker in self.workers:
             worker.join()
+        if hasattr(self.seen, 'stats'):
+            logger.info('Seen urls of %s: %s', self.name, self.seen.stats())
         print('Source.stop stopped', self.name)
 
-    def consume(self):
-        if self.urls:
-            for _ in range(self.url_amount):
-                url = get_next(self.urls)
-                if url is False:
-                    self.urls = False
-                    break
+    def consume(self, amount=None):
+        '''
+        Moves "amount" urls to the in_q, by default "url_amount" urls.
+        Returns the amount of urls that were consumed, including the urls
+        that were skipped because they were seen by a previous run.
+        '''
+        with self.lock:
+            return self._consume(amount or self.url_amount)
+
+    def _consume(self, amount):
+        consumed = 0
+        for _ in range(amount):
+            url, attrs, pattern = self._next_url()
+            if url is False:
+                break
+            consumed += 1
 
-                if self.attrs:
-                    if type(self.attrs) is list:
-                        attrs = self.attrs.pop()
-                    elif type(self.attrs) is dict:
-                        print(self.attrs)
-                        attrs = self.attrs
-                else:
+            kwargs = self.get_kwargs()
+
+            if type(url) is str:
+                url = self.url_template.format(url)
+            # The urls of the source are only skipped when they were
+            # retrieved by a previous run with a frontier. The patterns that
+            # were added, like the pages of a pagination which is found on
+            # every page, can repeat the same urls.
+            added = pattern is not None and pattern is not self.urls
+            if (added or self.frontier) and url in self.seen:
+                continue
+            # The urls generated by the UrlPattern of the source itself are
+            # unique, so they are only added to the seen urls of a frontier.
+            if pattern is None or added or self.frontier:
+                self.add_to_seen(url)
+            if pattern:
+                pattern.queued(url)
+            if self.debug:
+                print('source_debug', url, kwargs, attrs)
+            self.in_q.put((url, kwargs, attrs))
+            self.to_parse += 1
+        return consumed
+
+    def _next_url(self):
+        '''
+        Returns the next url, its attrs and the UrlPattern which generated
+        the url, if any. The url is False when there are no urls left, or
+        when the patterns have to wait for their urls to be parsed.
+        '''
+        limit = self.n_workers * getattr(self, 'concurrency', 1)
+        for pattern, attrs in list(self.patterns):
+            if not pattern.ready(limit):
+                continue
+            url = get_next(pattern)
+            if url is not False:
+                return url, attrs, pattern
+            self.patterns.remove((pattern, attrs))
+
+        if isinstance(self.urls, UrlPattern) and not self.urls.ready(limit):
+            return False, None, None
+        if self.urls:
+            url = get_next(self.urls)
+            if url is not False:
+                # Each url is paired with the attrs at the same position, a
+                # single dict is used for all the urls.
+                attrs = get_next(self.attrs) if self.attrs else {}
+                if attrs is False:
                     attrs = {}
+                pattern = self.urls if isinstance(self.urls, UrlPattern) \
+                    else None
+                return url, attrs, pattern
+            self.urls = False
+        return False, None, None
 
-                kwargs = self.get_kwargs()
+    def add_pattern(self, pattern, attrs):
+        '''
+        Adds the urls generated by a UrlPattern, for example the pages found
+        by HTMLParser.pagination. The urls are put in the in_q lazily, like
+        the urls of the source.
+        '''
+        with self.lock:
+            self.patterns.append((pattern, attrs))
+            if self.workers and not self.feeder:
+                self.start_feeder()
 
-                if type(url) is str:
-                    url = self.url_template.format(url)
-                if self.debug:
-                    print('source_debug', url, kwargs, attrs)
-                self.in_q.put((url, kwargs, attrs))
-                self.to_parse += 1
-                self.add_to_seen(url)
+    def parsed(self, url, amount):
+        '''
+        Called by the Scraper with the amount of objects that were parsed
+        from the data of the url, so a PageRange can stop after an empty
+        page.
+        '''
+        with self.lock:
+            patterns = [pattern for pattern, _ in self.patterns]
+            if isinstance(self.urls, UrlPattern):
+                patterns.append(self.urls)
+        for pattern in patterns:
+            pattern.parsed(url, amount)
 
     def add_to_seen(self, url):
         self.seen.add(url)
 
     def add_source(self, url, attrs, objct={}, re_insert=False):
+        if isinstance(url, UrlPattern):
+            return self.add_pattern(url, attrs)
         if url not in self.seen or re_insert:
             kwargs = self.get_kwargs(objct)
             if self.url_regex and not self.url_regex(url):
                 return False
             if type(url) is str and not re_insert:
                 url = self.url_template.format(url)
+            with self.lock:
+                self.to_parse += 1
             self.in_q.put((url, kwargs, attrs))
-            self.to_parse += 1
             self.add_to_seen(url)
 
     def get_kwargs(self, objct=None):
@@ -324,7 +521,7 @@ class BaseSource(object):
     def get_attr_names(self):
         if self.attrs:
             attrs_copy = copy(self.attrs)
-            if type(attrs_copy) in (list, types.GeneratorType):
+            if type(attrs_copy) in (list, deque, types.GeneratorType):
                 for attr in attrs_copy:
                     for name in attr.keys():
                         yield name
@@ -355,8 +552,7 @@ class BaseSourceWorker(Thread):
 
     def run(self):
         while True:
-            start = time.time()
-            item = self.in_q.get()
+            item = self.next_item()
             if item is None:
                 break
             try:
@@ -365,37 +561,197 @@ class BaseSourceWorker(Thread):
                 print(item, 'this went wrong')
             with self.semaphore:
                 self.retrieving = True
+                # Only the retrieval is timed, the time spent waiting for
+                # an item would lower the throughput of a starved worker.
+                start = time.time()
                 data = self.retrieve(url, kwargs)
-                # Determine if we need to re-insert the url
-                if data is False:
-                    with self.lock:
-                        self.parent.to_parse += 1
-                    self.in_q.put((url, kwargs, attrs))
 
             self._recalculate_mean(start)
+            self.handle_data(url, kwargs, attrs, data)
+
+            self.task_done(item)
+            self.retrieving = False
 
-            if data and self.parent.compression == 'zip':
-                data = self.read_zip_file(data)
-            self.out_q.put((url, data, attrs))
+    def next_item(self):
+        return self.in_q.get()
 
+    def task_done(self, item):
+        '''
+        Marks an item of the in_q as done. A frontier needs the item to
+        remove it from its database.
+        '''
+        if isinstance(self.in_q, SqliteQueue):
+            self.in_q.task_done(item)
+        else:
             self.in_q.task_done()
-            self.retrieving = False
 
     def retrieve(self):
         raise NotImplementedError
 
+    def handle_data(self, url, kwargs, attrs, data):
+        '''
+        Passes the data retrieved from the url on to the parent source. When
+        the retrieval failed (data is False), the url is re-inserted so it
+        will be retried later. If the data is a generator, each item it
+        yields is parsed separately.
+        '''
+        if data is False:
+            with self.lock:
+                self.parent.to_parse += 1
+            self.in_q.put((url, kwargs, attrs))
+
+        if isinstance(data, types.GeneratorType):
+            self.put_many(url, data, attrs)
+            return
+
+        if data and self.parent.compression:
+            members = (text for name, text in
+                       decompress(data, self.parent.compression,
+                                  chunk_size=self.parent.chunk_size))
+            if self.parent.split_members or self.parent.chunk_size:
+                self.put_many(url, members, attrs)
+                return
+            try:
+                data = ''.join(members)
+            except Exception:
+                self.logger.exception(
+                    'Could not decompress the data from: ' + str(url))
+                data = None
+        self.out_q.put((url, data, attrs))
+        self.parent.notify()
+
+    def put_many(self, url, items, attrs):
+        '''
+        Puts several items retrieved from a single url on the out_q, so each
+        of them is parsed separately. Each item is put as soon as it is
+        available. The items are often read while they are put, so an error
+        raised by the items is logged and ends them with a None item.
+        '''
+        data, put = None, 0
+        try:
+            for data in items:
+                self.put_item(url, data, attrs, put)
+                put += 1
+        except Exception:
+            self.logger.exception('Error reading the data from: ' + str(url))
+            data = None
+        if data is None:
+            self.put_item(url, data, attrs, put)
+
+    def put_item(self, url, data, attrs, put):
+        # The first item was counted when the url was queued.
+        if put:
+            with self.lock:
+                self.parent.to_parse += 1
+        self.out_q.put((url, data, attrs))
+        self.parent.notify()
+
     def _recalculate_mean(self, start):
         self.visited += 1
         self.total_time += time.time() - start
-        return self.total_time / self.visited
+        self.mean = self.total_time / self.visited
+        return self.mean
+
+
+class AsyncSourceWorker(BaseSourceWorker):
+    '''
+    A worker which runs an asyncio event loop inside of its Thread, so a
+    single worker can have many retrievals in flight at the same time.
+    Subclasses implement the "retrieve_async" coroutine instead of
+    "retrieve". If it returns an async generator, each item it yields is
+    parsed separately, as soon as it is yielded. The amount of retrievals in
+    flight is limited by the "concurrency" attribute of the parent source.
+    '''
 
-    def read_zip_file(self, zipfile):
-        content = ''
-        with ZipFile(BytesIO(zipfile)) as myzip:
-            for file_ in myzip.namelist():
-                with myzip.open(file_) as fle:
-                    content += fle.read().decode('utf8')
-        return content
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        slots = asyncio.Semaphore(self.parent.concurrency)
+        tasks = set()
+        await self.setup()
+        try:
+            while True:
+                # The in_q is a threading Queue, so we wait for it in an
+                # executor to keep the event loop running.
+                item = await loop.run_in_executor(None, self.in_q.get)
+                if item is None:
+                    break
+                await slots.acquire()
+                task = loop.create_task(self._process(item, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await self.teardown()
+
+    async def _process(self, item, slots):
+        start = time.time()
+        url, kwargs, attrs = item
+        self.in_flight += 1
+        self.retrieving = True
+        streamed = False
+        try:
+            data = await self.retrieve_async(url, kwargs)
+            if inspect.isasyncgen(data):
+                await self.put_many_async(url, data, attrs)
+                streamed = True
+        except Exception:
+            self.logger.exception('Error retrieving the data from: ' +
+                                  str(url))
+            data = None
+        finally:
+            self.in_flight -= 1
+            slots.release()
+
+        self._recalculate_mean(start)
+        if not streamed:
+            self.handle_data(url, kwargs, attrs, data)
+        self.task_done(item)
+        self.retrieving = self.in_flight > 0
+
+    async def put_many_async(self, url, items, attrs):
+        '''
+        Like "put_many", but for the items of an async generator returned by
+        "retrieve_async". Each item is put on the out_q as soon as it has
+        been retrieved.
+        '''
+        count = 0
+        try:
+            async for data in items:
+                # The first item was counted when the url was queued.
+                if count:
+                    with self.lock:
+                        self.parent.to_parse += 1
+                count += 1
+                self.out_q.put((url, data, attrs))
+                self.parent.notify()
+        except Exception:
+            self.logger.exception('Error retrieving the data from: ' +
+                                  str(url))
+        if not count:
+            self.out_q.put((url, None, attrs))
+            self.parent.notify()
+
+    async def setup(self):
+        pass
+
+    async def teardown(self):
+        pass
+
+    async def retrieve_async(self, url, kwargs):
+        raise NotImplementedError
 
 
 class Attr(BaseComponent):
@@ -487,6 +843,21 @@ class Attr(BaseComponent):
     def __setstate__(self, state):
         self.__dict__.update(state)
 
+    def parse_state(self):
+        '''
+        Returns the state which is needed to parse data with this Attr. Unlike
+        the pickled state of an Attr, it includes the func so the Attr can be
+        reconstructed in another process with "from_parse_state".
+        '''
+        return {key: self.__dict__[key] for key in
+                ('name', 'func', 'value', 'raw_data', 'multiple', 'type')}
+
+    @classmethod
+    def from_parse_state(cls, state):
+        attr = cls.__new__(cls)
+        attr.__dict__.update(state)
+        return attr
+
     def _evaluate_condition(self, objct):
         # TODO fix this ugly bit of code
         if self.source_condition:
@@ -624,6 +995,31 @@ class Model(BaseComponent):
     def __setstate__(self, state):
         self.__dict__.update(state)
 
+    def parse_state(self):
+        '''
+        Returns the state which is needed by "parse", so the Model can be
+        reconstructed in another process with "from_parse_state". The
+        sources and databases of the Model are not included.
+        '''
+        state = {key: self.__dict__[key] for key in
+                 ('name', 'selector', 'required', 'amount_of_attrs', 'dated',
+                  'debug')}
+        state['func_attrs'] = [attr.parse_state() for attr in self.func_attrs]
+        state['value_attrs'] = [attr.parse_state()
+                                for attr in self.value_attrs]
+        return state
+
+    @classmethod
+    def from_parse_state(cls, state):
+        model = cls.__new__(cls)
+        model.__dict__.update(state)
+        model.func_attrs = [Attr.from_parse_state(attr)
+                            for attr in state['func_attrs']]
+        model.value_attrs = [Attr.from_parse_state(attr)
+                             for attr in state['value_attrs']]
+        model.source = []
+        return model
+
     def validate(self):
         # Validate the functions of the attrs
         for attr in self.attrs:
@@ -651,15 +1047,24 @@ class Model(BaseComponent):
                             if source:
                                 source.add_source(objct['_url'], attrs, objct)
             else:
+                pattern = getattr(attr.func[-1], 'url_pattern', None) \
+                    if attr.func else None
                 for objct in objects:
                     if attr._evaluate_condition(objct):
-                        for url in wrap_list(objct[attr.name]):
-                            if url:
-                                attrs = {key: objct[key] for key in
-                                         self.transfers}
-                                attrs['_url'] = objct['url']
-                                for source in attr.emits:
-                                    source.add_source(url, attrs, objct)
+                        urls = [url for url in wrap_list(objct[attr.name])
+                                if url]
+                        # The pages of a pagination are generated lazily by
+                        # a PageRange for each source.
+                        if pattern and urls:
+                            for source in attr.emits:
+                                source.add_source(
+                                    pattern(stop=len(urls) + 1),
+                                    self.emitted_attrs(objct), objct)
+                            continue
+                        for url in urls:
+                            attrs = self.emitted_attrs(objct)
+                            for source in attr.emits:
+                                source.add_source(url, attrs, objct)
 
         if self.emits:
             for objct in objects:
@@ -674,52 +1079,143 @@ class Model(BaseComponent):
                     logging.warning(warning.format(self.name))
         return True
 
+    def emitted_attrs(self, objct):
+        attrs = {key: objct[key] for key in self.transfers}
+        attrs['_url'] = objct['url']
+        return attrs
+
     def attrs_from_dict(self, attrs):
         self.attrs = attr_dict(
             (Attr(name=name, value=value) for name, value in attrs.items()))
 
-    def parse(self, url, attrs, raw_data, verbose=False):
-        objects, urls = [], []
+    def document(self, url, raw_data, func, documents):
+        '''
+        Returns the raw data converted by the parser of the func. The
+        converted data is kept in the documents dict, so the raw data from
+        one url is converted only once for each parser, no matter how many
+        Attrs and Models use it.
+        '''
+        parser = getattr(func, 'parser', getattr(func, '__self__', None))
+        if not hasattr(parser, 'convert_data'):
+            return raw_data
 
-        if raw_data:
-            extracted = raw_data
-            for sel in self.selector:
-                extracted = sel(url, extracted)
+        key = (url, parser)
+        if key not in documents:
+            documents[key] = parser.convert_data(url, raw_data)
+        return documents[key]
 
-            for data in extracted:
-                obj = {'_url': url, **attrs}
+    @property
+    def stream(self):
+        '''
+        True if the selector of the Model parses the raw data incrementally,
+        like HTMLParser.iterparse.
+        '''
+        return getattr(self.selector[0], 'stream', False)
 
-                no_value = 0
-                for attr in self.func_attrs:
-                    value = attr.parse(url, data if not attr.raw_data else
-                                       raw_data)
-                    if not value:
-                        no_value += 1
-                    obj[attr.name] = value
+    def iter_parse(self, url, attrs, raw_data, documents=None, retry=None):
+        '''
+        Yields the objects parsed from the raw data retrieved from the url one
+        by one. See "parse" for the parameters.
+        '''
+        if documents is None:
+            documents = {}
+        if retry is None:
+            retry = self.retry
 
-                if self.required:
-                    if no_value == self.amount_of_attrs:
-                        for source in self.source:
-                            source.add_source(url, attrs, re_insert=True)
-                        continue
+        if not raw_data:
+            return
 
-                for attr in self.value_attrs:
-                    obj[attr.name] = attr.value
+        if self.stream:
+            # The streaming selector parses the raw data itself.
+            extracted = raw_data
+        else:
+            extracted = self.document(url, raw_data, self.selector[0],
+                                      documents)
+        for sel in self.selector:
+            extracted = sel(url, extracted)
+
+        for data in extracted:
+            obj = {'_url': url, **attrs}
+
+            no_value = 0
+            for attr in self.func_attrs:
+                if attr.raw_data:
+                    value = attr.parse(url, self.document(
+                        url, raw_data, attr.func[0], documents))
+                else:
+                    value = attr.parse(url, data)
+                if not value:
+                    no_value += 1
+                obj[attr.name] = value
+
+            if self.required:
+                if no_value == self.amount_of_attrs:
+                    retry(url, attrs)
+                    continue
 
-                if 'url' not in obj:
-                    obj['url'] = url
+            for attr in self.value_attrs:
+                obj[attr.name] = attr.value
 
-                urls.extend(obj.get('url', []))
+            if 'url' not in obj:
+                obj['url'] = url
 
-                if self.dated:
-                    obj['_date'] = str(datetime.now())
+            if self.dated:
+                obj['_date'] = str(datetime.now())
 
-                objects.append(obj)
-            if self.debug:
-                print(self.name, url, 'parsed:')
-                pp.pprint(objects)
+            yield obj
+
+    def parse(self, url, attrs, raw_data, verbose=False, documents=None,
+              retry=None):
+        '''
+        Parses the raw data retrieved from the url into objects.
+
+        Parameters
+        ----------
+        documents : dict, optional
+            The documents already converted from the raw data. Pass the same
+            dict to each Model parsing the raw data from the same url to
+            convert the raw data only once.
+
+        retry : function, optional
+            Called with the url and attrs when a required Model found no
+            values in the data. Defaults to the "retry" method.
+        '''
+        objects, urls = [], []
+        for obj in self.iter_parse(url, attrs, raw_data, documents=documents,
+                                   retry=retry):
+            urls.extend(wrap_list(obj['url']) or [])
+            objects.append(obj)
+        if self.debug and raw_data:
+            print(self.name, url, 'parsed:')
+            pp.pprint(objects)
         return objects, urls
 
+    def parse_chunks(self, url, attrs, raw_data, documents=None,
+                     chunk_size=1000):
+        '''
+        Yields the (objects, urls) parsed from the raw data. If the Model
+        streams its data, the objects are yielded in chunks of "chunk_size"
+        while the data is being parsed. Otherwise all the objects are yielded
+        at once, like "parse" returns them.
+        '''
+        if not self.stream:
+            yield self.parse(url, attrs, raw_data, documents=documents)
+            return
+
+        objects, urls = [], []
+        for obj in self.iter_parse(url, attrs, raw_data, documents=documents):
+            urls.extend(wrap_list(obj['url']) or [])
+            objects.append(obj)
+            if len(objects) >= chunk_size:
+                yield objects, urls
+                objects, urls = [], []
+        if objects:
+            yield objects, urls
+
+    def retry(self, url, attrs):
+        for source in self.source:
+            source.add_source(url, attrs, re_insert=True)
+
     def store_objects(self, objects, urls):
         for db in self.database:
             db.store(self, objects, urls)
@@ -733,9 +1229,102 @@ class Model(BaseComponent):
         yield from self.query()
 
 
+_parse_models = []
+
+
+def _start_parse_process(states):
+    _parse_models.extend(Model.from_parse_state(state)
+                         for state in pickle.loads(states))
+
+
+def _parse_in_process(indexes, url, attrs, data):
+    documents = {}
+    parsed = []
+    for index in indexes:
+        retries = []
+        objects, urls = _parse_models[index].parse(
+            url, attrs, data, documents=documents,
+            retry=lambda *retry: retries.append(retry))
+        parsed.append((index, objects, urls, retries))
+    return parsed
+
+
+class ParsePool(object):
+    '''
+    Parses the data retrieved by the sources in a pool of processes. The
+    Models are sent to the processes once, after that only the data retrieved
+    from each url is sent to the processes and plain objects are returned.
+    '''
+
+    def __init__(self, sources, processes):
+        self.models = list({model: None for source in sources
+                            for model in source.models})
+        self.index = {model: i for i, model in enumerate(self.models)}
+        states = pickle.dumps([model.parse_state() for model in self.models])
+        self.pool = multiprocessing.Pool(processes, _start_parse_process,
+                                         (states,))
+        self.results = Queue()
+
+    def submit(self, source, url, attrs, data):
+        indexes = [self.index[model] for model in source.models]
+        source.parsing += 1
+        self.pool.apply_async(
+            _parse_in_process, (indexes, url, attrs, data),
+            callback=lambda parsed: self._done(source, url, parsed),
+            error_callback=lambda error: self._error(source, url, error))
+
+    def _done(self, source, url, parsed):
+        self.results.put((source, url, parsed))
+        source.notify()
+
+    def _error(self, source, url, error):
+        logger.error('Could not parse {}: {!r}'.format(url, error))
+        self._done(source, url, [])
+
+    def parsed(self):
+        '''
+        Yields the parsed results that are available as (source, url, parsed)
+        where parsed is a list of (model, objects, urls, retries).
+        '''
+        while True:
+            try:
+                source, url, parsed = self.results.get_nowait()
+            except Empty:
+                break
+            yield source, url, [(self.models[index], objects, urls, retries)
+                                for index, objects, urls, retries in parsed]
+
+    def stop(self):
+        self.pool.close()
+        self.pool.join()
+
+
 class Scraper(object):
     def __init__(self, name='', models=[], num_sources=1, awaiting=False,
-                 schedule='', logfile='', dummy=False, recurring=[]):
+                 schedule='', logfile='', dummy=False, recurring=[],
+                 rate_limiter=None, parse_workers=0, check_interval=5,
+                 checkpoint=''):
+        '''
+        Parameters
+        ----------
+        parse_workers : int, optional
+            The amount of processes used to parse the retrieved data. By
+            default the data is parsed in the main process. All the parser
+            functions and selectors used by the Models must be picklable to
+            use the processes, i.e. the functions passed to custom_func must
+            be defined at the module level.
+
+        check_interval : int, optional
+            The Scraper processes the data of a source as soon as the source
+            has data ready. When none of the sources have notified the Scraper
+            for this amount of seconds, all the sources are checked.
+
+        checkpoint : str, optional
+            A directory in which the frontier of each source is stored. When
+            the Scraper is started again with the same checkpoint, it resumes
+            where the previous run stopped. See the "frontier" parameter of
+            the sources.
+        '''
         super().__init__()
         self.name = name
         self.models = models
@@ -745,6 +1334,12 @@ class Scraper(object):
         self.sources = set()
         self.recurring = recurring
         self._dummy = dummy
+        self.rate_limiter = rate_limiter
+        self.parse_workers = parse_workers
+        self.parse_pool = None
+        self.check_interval = check_interval
+        self.checkpoint = checkpoint
+        self.ready = None
 
         # Set up the logging
         if logfile:
@@ -764,11 +1359,38 @@ class Scraper(object):
             for db in model.database:
                 self.databases.add(db)
 
+        if self.checkpoint:
+            os.makedirs(self.checkpoint, exist_ok=True)
+            for source in self.sources:
+                if not source.frontier:
+                    assert source.name, 'A source needs a name to be ' + \
+                        'stored in a checkpoint'
+                    source.use_frontier(os.path.join(
+                        self.checkpoint, source.name + '.frontier'))
+
         # Restrict the amount of source workers working at the same time.
         self.semaphore = BoundedSemaphore(self.num_sources)
         for source in self.sources:
             source.semaphore = self.semaphore
 
+        # Share one rate limiter between the sources, so sources requesting
+        # urls from the same domain do not add up their request rates.
+        limited = [source for source in self.sources
+                   if getattr(source, 'rate_limiter', None)]
+        if limited:
+            if not self.rate_limiter:
+                self.rate_limiter = DomainRateLimiter.combine(
+                    source.rate_limiter for source in limited)
+            for source in limited:
+                source.rate_limiter = self.rate_limiter
+
+        # Share one DNS cache between the sources, so a dead host is only
+        # looked up once.
+        cached = [source for source in self.sources
+                  if getattr(source, 'dns_cache', None)]
+        for source in cached:
+            source.use_dns_cache(cached[0].dns_cache)
+
         self.validate()
 
     def validate(self):
@@ -826,39 +1448,108 @@ class Scraper(object):
         Every iteration processes the data retrieved from one url for each
         Source.
         '''
+        if self.parse_workers:
+            # The pool is started before the threads of the sources, so the
+            # worker processes are not forked from a multi-threaded process.
+            self.parse_pool = ParsePool(self.sources, self.parse_workers)
+        self.ready = Queue()
+        for source in self.sources:
+            source.ready = self.ready
         self.call_start(self.databases)
         self.call_start(self.sources)
-        while self.sources:
-            empty = []
-            for source in self.sources:
-                res = source.get_source()
-                if res:
-                    url, attrs, data = res
-                    for model in source.models:
-                        objects, urls = model.parse(url, attrs, data)
-                        if objects:
-                            logger.info('Parsed model {}, source {}, url {}' +
-                                        ', #objcects {}'.format(model.name,
-                                                                source.name,
-                                                                url,
-                                                                len(objects)))
-                            if self.dummy:
-                                pp.pprint(objects[:10])
-                            else:
-                                model.store_objects(objects, urls)
-                            model.gen_source(objects)
-                        else:
-                            logger.info('No objects for model {} and url' +
-                                        '{}'.format(model.name, url))
-                elif res is False:
-                    logger.info('Stopping ' + str(source.name))
-                    empty.append(source)
-                else:
-                    continue
-            for source in empty:
-                self.sources.discard(source)
+
+        # Each source is checked once to seed its workers, after that a source
+        # is only checked when it notifies the Scraper.
+        ready = set(self.sources)
+        while True:
+            for source in ready & self.sources:
+                self.process_source(source)
+            if self.parse_pool:
+                self.process_parsed()
+            if not self.sources:
+                break
+            ready = self.wait_for_sources()
+
+        if self.parse_pool:
+            self.parse_pool.stop()
         self.call_stop(self.databases)
 
+    def wait_for_sources(self):
+        '''
+        Waits until at least one source notifies the Scraper and returns all
+        the sources that have notified it. After "check_interval" seconds
+        without notifications, all the sources are checked.
+        '''
+        try:
+            ready = {self.ready.get(timeout=self.check_interval)}
+        except Empty:
+            return set(self.sources)
+        while True:
+            try:
+                ready.add(self.ready.get_nowait())
+            except Empty:
+                return ready
+
+    def process_source(self, source):
+        retrieved = not source.out_q.empty()
+        res = source.get_source(block=False)
+        if res:
+            url, attrs, data = res
+            if self.parse_pool:
+                self.parse_pool.submit(source, url, attrs, data)
+            else:
+                documents = {}
+                amount = 0
+                for model in source.models:
+                    for objects, urls in model.parse_chunks(
+                            url, attrs, data, documents=documents):
+                        amount += len(objects)
+                        self.process_objects(source, model, url, objects,
+                                             urls)
+                source.parsed(url, amount)
+        elif res is False:
+            logger.info('Stopping ' + str(source.name))
+            self.sources.discard(source)
+            # The sources downstream of this source might be done now.
+            for other in self.sources:
+                if source in other.upstream_sources:
+                    other.notify()
+            return
+
+        # Check the source again to see whether it is done or whether it has
+        # more data ready.
+        if retrieved and (not source.to_parse or not source.out_q.empty()):
+            source.notify()
+
+    def process_parsed(self):
+        '''
+        Stores the objects which were parsed by the parse pool.
+        '''
+        for source, url, parsed in self.parse_pool.parsed():
+            for model, objects, urls, retries in parsed:
+                for retry in retries:
+                    model.retry(*retry)
+                self.process_objects(source, model, url, objects, urls)
+            source.parsed(url, sum(len(objects) for _, objects, _, _ in
+                                   parsed))
+            source.parsing -= 1
+            if not source.parsing:
+                source.notify()
+
+    def process_objects(self, source, model, url, objects, urls):
+        if objects:
+            logger.info('Parsed model {}, source {}, url {}, '
+                        '#objects {}'.format(model.name, source.name, url,
+                                             len(objects)))
+            if self.dummy:
+                pp.pprint(objects[:10])
+            else:
+                model.store_objects(objects, urls)
+            model.gen_source(objects)
+        else:
+            logger.info('No objects for model {} and url {}'.format(
+                model.name, url))
+
     def call_start(self, iterator):
         for obj in iterator:
             obj.start()
@@ -1,18 +1,23 @@
 from collections import defaultdict
 from contextlib import closing
 from datetime import datetime
-from itertools import zip_longest
 from multiprocessing import JoinableQueue as Queue
 from multiprocessing import Process
+from queue import Empty
 import csv
 import json
 import logging
 import os
+import pickle
 import pprint
 import sqlite3
 import subprocess
 import time
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 from .helpers import add_other_doc
 
@@ -26,6 +31,26 @@ forbidden_characters = 'These characters {} cannot be in the name {}'
 logger = logging.getLogger(__name__)
 
 
+def dumps(data):
+    '''
+    Serializes the objects sent to the database workers with msgpack if it is
+    installed, falling back to pickle for the values msgpack does not
+    support.
+    '''
+    if msgpack:
+        try:
+            return b'm' + msgpack.packb(data, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return b'p' + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    if data[:1] == b'm':
+        return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+    return pickle.loads(data[1:])
+
+
 class MetaDatabaseImplementation(type):
     def __new__(meta, name, bases, class_dict):
         funcs = ['create', 'read', 'update', 'delete']
@@ -42,44 +67,119 @@ class BaseDatabaseImplementation(Process,
                                  metaclass=MetaDatabaseImplementation):
     create, read, update, delete = None, None, None, None
 
-    def __init__(self, parent=None, database=None, table='', cache=10):
+    def __init__(self, parent=None, database=None, table='', cache=None,
+                 flush_interval=None):
         super().__init__()
         self.parent = parent
         self.db = database
         self.table = table
         self.in_q = parent.in_q
         self.parent = parent
-        self.cache = cache
+        self.cache = cache or parent.cache
+        self.flush_interval = flush_interval or parent.flush_interval
         self.func = getattr(self, parent.func, None)
         self.logger = logging.getLogger('Databases.' + self.__class__.__name__)
 
     def run(self):
+        '''
+        Collects the objects of each model in batches, which are stored when
+        they contain "cache" objects or when their oldest object has waited
+        "flush_interval" milliseconds.
+        '''
+        batches = {}
+        models = {}
+        # The time at which each batch has to be stored. The deadlines are
+        # checked after every item, since a busy queue never times out.
+        flush_at = {}
         while True:
-            item = self.in_q.get()
+            now = time.time()
+            expired = [key for key, deadline in flush_at.items()
+                       if deadline <= now]
+            if expired:
+                self.flush({key: batches.pop(key) for key in expired})
+                for key in expired:
+                    del flush_at[key]
+                now = time.time()
+
+            timeout = max(min(flush_at.values()) - now, 0) if flush_at \
+                else None
+            try:
+                item = self.in_q.get(timeout=timeout)
+            except Empty:
+                continue
 
             if item is None:
+                self.flush(batches)
                 break
-            model, objects, urls = item
-
+            self.in_q.task_done()
+
+            # The models are registered once, after that they are referred to
+            # by their id.
+            message, model_id, data = item
+            if message == 'register':
+                models[model_id] = data
+                continue
+            model = models[model_id]
+            objects, urls = loads(data)
+
+            key = (model.name, model.table)
+            if key not in batches:
+                batches[key] = (model, [], [])
+            batches[key][1].extend(objects)
+            batches[key][2].extend(urls)
+
+            if len(batches[key][1]) >= self.cache:
+                self.flush({key: batches.pop(key)})
+                flush_at.pop(key, None)
+            elif key not in flush_at:
+                flush_at[key] = time.time() + self.flush_interval / 1000
+
+    def flush(self, batches):
+        for model, objects, urls in batches.values():
             # Call to the functions in this class
             try:
                 self.func(model, objects, urls, **model.kws)
-                self.in_q.task_done()
             except Exception:
                 self.logger.exception('Template storing error:' +
                                       str(model.name) + str(objects))
+        batches.clear()
 
 
 class BaseDatabase(object):
     forbidden_chars = []
 
-    def __init__(self, db='', table='', func='create', drop_on_start=False):
+    def __init__(self, db='', table='', func='create', drop_on_start=False,
+                 cache=100, flush_interval=1000):
+        '''
+        Parameters
+        ----------
+        db : str
+             The name of the database.
+
+        table : str, optional
+                The table used for the models which do not set a table.
+
+        func : str, optional
+               The function used to store the objects: create, update or
+               delete.
+
+        cache : int, optional
+                The amount of objects of a model that are collected before
+                they are stored in one go.
+
+        flush_interval : int, optional
+                The maximum amount of milliseconds that objects are kept
+                before they are stored.
+        '''
         assert db, "At least the database name is required"
         self.in_q = Queue()
         self.db = db
         self.table = table
         self.func = func
         self.drop_on_start = drop_on_start
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self.models = {}
 
     def check_forbidden_chars(self, key):
         if any(c in key for c in self.forbidden_chars):
@@ -88,8 +188,13 @@ class BaseDatabase(object):
                                             str(key)))
 
     def store(self, model, objects, urls):
-        # pp.pprint(objects)
-        self.worker.in_q.put((model, objects, urls))
+        # The model is only sent to the worker process the first time, after
+        # that the objects are sent with the id of the model.
+        if model not in self.models:
+            self.models[model] = len(self.models)
+            self.worker.in_q.put(('register', self.models[model], model))
+        self.worker.in_q.put(('store', self.models[model],
+                              dumps((objects, urls))))
 
     def start(self):
         assert self.worker, "There is no worker to start"
@@ -99,6 +204,8 @@ class BaseDatabase(object):
         if self.worker.is_alive():
             print('stopping', self.name)
             self.worker.in_q.put(None)
+            # Wait for the worker to store the objects it still holds.
+            self.worker.join()
 
 
 class MongoDB(BaseDatabase):
@@ -287,18 +394,30 @@ def json_converter(s):
 class Sqlite(BaseDatabase):
     name = 'SQlite'
 
-    def __init__(self, *args, **kwargs):
+    @add_other_doc(BaseDatabase.__init__, 'Parameters')
+    def __init__(self, wide=False, *args, **kwargs):
+        '''
+        Parameters
+        ----------
+        wide : bool, optional
+               By default each attr of a model is stored in its own table.
+               If set to True, each model is stored in a single table with a
+               column for each attr. Attrs with multiple values are stored
+               as JSON.
+        '''
         super().__init__(*args, **kwargs)
         connection = sqlite3.connect(self.db + '.db',
-                                     sqlite3.PARSE_DECLTYPES)
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        connection.execute('PRAGMA journal_mode=WAL')
         sqlite3.register_adapter(dict, json_adapter)
         sqlite3.register_converter('dict', json_converter)
         sqlite3.register_adapter(list, json_adapter)
         sqlite3.register_converter('list', json_converter)
         sqlite3.register_adapter(tuple, json_adapter)
         sqlite3.register_converter('tuple', json_converter)
-        self.worker = SqliteWorker(parent=self, database=connection,
-                                   table=self.table)
+        worker = SqliteWideWorker if wide else SqliteWorker
+        self.worker = worker(parent=self, database=connection,
+                             table=self.table)
 
 
 class SqliteWorker(BaseDatabaseImplementation):
@@ -322,7 +441,9 @@ class SqliteWorker(BaseDatabaseImplementation):
 
     update_query = "UPDATE {table} SET {attr} = ? WHERE id = ?"
 
-    id_query = "SELECT url, id FROM {table} WHERE url = ?"
+    id_query = "SELECT url, id FROM {table} WHERE url IN ({urls})"
+
+    max_id_query = "SELECT MAX(id) FROM {table}"
 
     def __init__(self, parent, database, new=False, **kwargs):
         super().__init__(parent, database, **kwargs)
@@ -371,34 +492,43 @@ class SqliteWorker(BaseDatabaseImplementation):
         table = self.get_table(model.table)
 
         with self.db as con:
-            values = ((none, str(url)) for none, url in
-                      zip([None] * len(urls), urls))
-            con.executemany(self.insert_query.format(table=table), values)
-
-            # We select all the ids that were inserted to create the attrs
-            urls_ids = dict(self.urls_ids(table, urls))
+            # A row is inserted for each object. The write lock is taken
+            # before the highest id is read, so no other writer can insert
+            # rows until the transaction is committed and the new rows get
+            # the ids following it.
+            con.execute('BEGIN IMMEDIATE')
+            last_id = con.execute(self.max_id_query.format(
+                table=table)).fetchone()[0]
+            first_id = (last_id or 0) + 1
+            con.executemany(self.insert_query.format(table=table),
+                            ((None, str(obj.get('url'))) for obj in objects))
+            ids = range(first_id, first_id + len(objects))
 
             for attr in model.attrs:
                 table_name = '_'.join((table, attr.name))
-
-                for obj, url in zip(objects, urls):
-                    db_id = urls_ids[str(url)]
-                    if attr.multiple and len(obj[attr.name]) > 1:
-                        values = list(zip_longest(obj[attr.name], [db_id],
-                                                  fillvalue=db_id))
-                        con.executemany(self.insert_query.format(
-                            table=table_name), values)
+                values = []
+                for obj, db_id in zip(objects, ids):
+                    value = obj.get(attr.name)
+                    if attr.multiple and type(value) is list:
+                        # An empty list has no rows.
+                        values.extend((db_id, item) for item in value)
                     else:
-                        values = (db_id, obj[attr.name])
-                        con.execute(self.insert_query.format(table=table_name),
-                                    values)
+                        values.append((db_id, value))
+                con.executemany(self.insert_query.format(table=table_name),
+                                values)
 
     def urls_ids(self, table, urls):
-        id_query = self.id_query.format(table=table)
+        '''
+        Selects the ids of the urls with a query for each 500 urls.
+        '''
+        urls = [str(url) for url in urls]
         urls_ids = []
         with self.db as con:
-            for url in urls:
-                urls_ids.extend(con.execute(id_query, (str(url),)).fetchall())
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                id_query = self.id_query.format(
+                    table=table, urls=', '.join('?' * len(chunk)))
+                urls_ids.extend(con.execute(id_query, chunk).fetchall())
         return urls_ids
 
     def update(self, model, objects, urls, *args, **kwargs):
@@ -431,6 +561,92 @@ class SqliteWorker(BaseDatabaseImplementation):
         pass
 
 
+class SqliteWideWorker(BaseDatabaseImplementation):
+    '''
+    A database implementation for Sqlite3 which stores each model in a single
+    table with a column for each attr. All the objects in a batch are stored
+    with one statement.
+    '''
+
+    model_table = '''CREATE TABLE IF NOT EXISTS "{table}"
+        (id INTEGER PRIMARY KEY ASC, url TEXT)'''
+
+    url_index = 'CREATE INDEX IF NOT EXISTS "{table}_url" ON "{table}" (url)'
+
+    add_column = 'ALTER TABLE "{table}" ADD COLUMN "{attr}" {type}'
+
+    def __init__(self, parent, database, **kwargs):
+        super().__init__(parent, database, **kwargs)
+        self.model_schema = {}
+
+    def get_table(self, table):
+        if not table:
+            return self.table
+        return table
+
+    def columns(self, model):
+        '''
+        Returns the name and the type of the column of each attr. The url is
+        stored in the url column of the table.
+        '''
+        for attr in model.attrs:
+            if attr.name != 'url':
+                if attr.multiple:
+                    yield attr.name, 'list'
+                else:
+                    yield attr.name, attr.type if attr.type else 'TEXT'
+
+    def check_schema(self, model):
+        table = self.get_table(model.table)
+        # Models without a table share the table of the database, each of
+        # them adds the columns of its own attrs.
+        key = (table, model.name)
+        if key not in self.model_schema:
+            with self.db as con:
+                con.execute(self.model_table.format(table=table))
+                con.execute(self.url_index.format(table=table))
+                existing = [row[1] for row in con.execute(
+                    'PRAGMA table_info("{}")'.format(table))]
+                for attr, value_type in self.columns(model):
+                    if attr not in existing:
+                        con.execute(self.add_column.format(
+                            table=table, attr=attr, type=value_type))
+            self.model_schema[key] = [attr for attr, _ in
+                                      self.columns(model)]
+        return table, self.model_schema[key]
+
+    def create(self, model, objects, urls, *args, **kwargs):
+        table, columns = self.check_schema(model)
+        query = 'INSERT INTO "{}" (url, {}) VALUES (?, {})'.format(
+            table, ', '.join('"{}"'.format(c) for c in columns),
+            ', '.join('?' * len(columns)))
+        with self.db as con:
+            con.executemany(query, ([obj.get('url')] +
+                                    [obj.get(c) for c in columns]
+                                    for obj in objects))
+
+    def update(self, model, objects, urls, *args, **kwargs):
+        table, columns = self.check_schema(model)
+        query = 'UPDATE "{}" SET {} WHERE url = ?'.format(
+            table, ', '.join('"{}" = ?'.format(c) for c in columns))
+        with self.db as con:
+            con.executemany(query, ([obj.get(c) for c in columns] +
+                                    [obj.get('url')] for obj in objects))
+
+    def delete(self, model, objects, urls, *args, **kwargs):
+        table, columns = self.check_schema(model)
+        query = 'DELETE FROM "{}" WHERE url = ?'.format(table)
+        with self.db as con:
+            con.executemany(query, ((obj.get('url'),) for obj in objects))
+
+    def read(self, model, urls, *args, **kwargs):
+        table, columns = self.check_schema(model)
+        query = 'SELECT url, {} FROM "{}"'.format(
+            ', '.join('"{}"'.format(c) for c in columns), table)
+        for row in self.db.execute(query):
+            yield dict(zip(['url', *columns], row))
+
+
 class File(BaseDatabase):
     '''
     A database that has files as storage. The db parameter will be interpreted
@@ -0,0 +1,279 @@
+from queue import Empty
+from threading import Condition, Lock
+import hashlib
+import pickle
+import sqlite3
+import sys
+import time
+
+from pybloom_live import ScalableBloomFilter
+
+from .urls import canonical_url
+
+
+def connect(filename):
+    connection = sqlite3.connect(filename, check_same_thread=False,
+                                 isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+class SqliteQueue(object):
+    '''
+    A queue of (url, kwargs, attrs) items that is stored in an Sqlite
+    database, so the urls that still have to be retrieved survive a crash.
+    It can be used instead of the queue.Queue of a source.
+
+    An item is only removed from the database when "task_done" is called
+    with it. Items that were taken from the queue but were not done when the
+    process stopped are put back in the queue when the database is opened.
+    '''
+
+    create_table = '''CREATE TABLE IF NOT EXISTS frontier
+        (id INTEGER PRIMARY KEY AUTOINCREMENT, item BLOB,
+         taken INTEGER DEFAULT 0)'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = connect(filename)
+        self.connection.execute(self.create_table)
+        self.connection.execute('UPDATE frontier SET taken = 0')
+        self.size = self.connection.execute(
+            'SELECT COUNT(*) FROM frontier').fetchone()[0]
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        # The row ids of the items that were taken, by the id of the item.
+        # The item is kept as well, so its id is not reused.
+        self.taken = {}
+        # The None items that stop the workers are not stored.
+        self.sentinels = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_empty:
+            if item is None:
+                self.sentinels += 1
+            else:
+                self.connection.execute(
+                    'INSERT INTO frontier (item) VALUES (?)',
+                    (pickle.dumps(item),))
+                self.size += 1
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if block:
+                end = time.monotonic() + timeout if timeout else None
+                while not self.sentinels and not self.size:
+                    remaining = end - time.monotonic() if end else None
+                    if remaining is not None and remaining <= 0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+
+            if self.sentinels:
+                self.sentinels -= 1
+                return None
+            row = self.connection.execute(
+                'SELECT id, item FROM frontier WHERE taken = 0 '
+                'ORDER BY id LIMIT 1').fetchone()
+            if not row:
+                raise Empty
+            self.connection.execute(
+                'UPDATE frontier SET taken = 1 WHERE id = ?', (row[0],))
+            self.size -= 1
+            item = pickle.loads(row[1])
+            self.taken[id(item)] = (row[0], item)
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self, item=None):
+        '''
+        Removes the item, which was returned by "get", from the database.
+        Without an item nothing is removed, so the item is retrieved again
+        when the database is reopened.
+        '''
+        with self.lock:
+            row_id, _ = self.taken.pop(id(item), (None, None))
+            if row_id is not None:
+                self.connection.execute('DELETE FROM frontier WHERE id = ?',
+                                        (row_id,))
+
+    def qsize(self):
+        return self.size + self.sentinels
+
+    def empty(self):
+        return not self.qsize()
+
+
+class SqliteSeen(object):
+    '''
+    A set of the urls that have been seen by a source, stored in an Sqlite
+    database. Without a filename, the urls are stored in a temporary
+    database on disk, which is removed when it is closed.
+    '''
+
+    create_table = 'CREATE TABLE IF NOT EXISTS seen (url PRIMARY KEY)'
+
+    def __init__(self, filename=''):
+        self.filename = filename
+        self.connection = connect(filename)
+        self.connection.execute(self.create_table)
+        self.lock = Lock()
+
+    @staticmethod
+    def key(url):
+        if type(url) is str:
+            return url
+        return pickle.dumps(url)
+
+    def __contains__(self, url):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT 1 FROM seen WHERE url = ?',
+                (self.key(url),)).fetchone() is not None
+
+    def add(self, url):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO seen (url) VALUES (?)',
+                (self.key(url),))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def __iter__(self):
+        # The urls are read in batches, so a large table is not loaded at
+        # once.
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    'SELECT rowid, url FROM seen WHERE rowid > ? '
+                    'ORDER BY rowid LIMIT 1000', (last,)).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+            for _, url in rows:
+                yield url if type(url) is str else pickle.loads(url)
+
+    def memory(self):
+        return 0
+
+
+class DigestSet(object):
+    '''
+    An exact set of urls kept in memory, which only stores a 16 byte digest
+    of each url.
+    '''
+
+    def __init__(self):
+        self.digests = set()
+
+    @staticmethod
+    def key(url):
+        if type(url) is not str:
+            url = pickle.dumps(url)
+        else:
+            url = url.encode('utf8')
+        return hashlib.blake2b(url, digest_size=16).digest()
+
+    def __contains__(self, url):
+        return self.key(url) in self.digests
+
+    def add(self, url):
+        self.digests.add(self.key(url))
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __iter__(self):
+        raise TypeError('The urls of a DigestSet can not be retrieved')
+
+    def memory(self):
+        # Each digest is a bytes object of 49 bytes.
+        return sys.getsizeof(self.digests) + 49 * len(self.digests)
+
+
+class SeenFilter(object):
+    '''
+    The urls seen by a source. The urls are canonicalized and stored in an
+    exact store, so no url is dropped because of a false positive. By
+    default the store is a temporary Sqlite database on disk, with a
+    ScalableBloomFilter in memory as a prefilter, so the store is only
+    checked for the urls that might have been seen.
+
+    Attributes
+    ----------
+    false_positives : int
+        The amount of urls which were in the bloom filter, but not in the
+        store.
+    '''
+
+    def __init__(self, store=None, prefilter=True, error_rate=0.001,
+                 capacity=100000):
+        '''
+        Parameters
+        ----------
+        store : SqliteSeen or DigestSet, optional
+                The exact store of the urls. Defaults to an SqliteSeen with a
+                temporary database. A DigestSet keeps a digest of each url in
+                memory, which is faster but uses more memory.
+
+        prefilter : bool, optional
+                    Whether to use a bloom filter as a prefilter.
+
+        error_rate : float, optional
+                     The false positive rate of the bloom filter.
+
+        capacity : int, optional
+                   The initial capacity of the bloom filter. It grows when
+                   more urls are added, but each growth makes a lookup
+                   slower.
+        '''
+        self.store = store if store is not None else SqliteSeen()
+        self.bloom = ScalableBloomFilter(
+            initial_capacity=capacity, error_rate=error_rate,
+            mode=ScalableBloomFilter.LARGE_SET_GROWTH) if prefilter else None
+        self.false_positives = 0
+        self.lock = Lock()
+
+        # The bloom filter has to contain the urls which were stored by a
+        # previous run.
+        if self.bloom is not None and len(self.store):
+            for url in self.store:
+                self.bloom.add(url)
+
+    def __contains__(self, url):
+        url = canonical_url(url)
+        with self.lock:
+            if self.bloom is not None and url not in self.bloom:
+                return False
+            if url in self.store:
+                return True
+            if self.bloom is not None:
+                self.false_positives += 1
+            return False
+
+    def add(self, url):
+        url = canonical_url(url)
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(url)
+            self.store.add(url)
+
+    def __len__(self):
+        return len(self.store)
+
+    def stats(self):
+        '''
+        Returns the amount of urls, the false positives of the bloom filter
+        and the memory used in bytes.
+        '''
+        bloom = sum(f.num_bits for f in self.bloom.filters) // 8 \
+            if self.bloom is not None else 0
+        return {'urls': len(self), 'false_positives': self.false_positives,
+                'bloom_memory': bloom, 'store_memory': self.store.memory()}
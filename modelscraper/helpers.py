@@ -1,4 +1,13 @@
+from collections import deque
+from collections.abc import Iterator
+from contextlib import closing
+from io import BytesIO, TextIOWrapper
+from zipfile import ZipFile
+import bz2
+import gzip
+import lzma
 import types
+
 from numpydoc.docscrape import NumpyDocString
 
 
@@ -25,13 +34,22 @@ def extract_section(obj, section):
     return []
 
 
-def get_next(iterator, index=0):
-    if isinstance(iterator, list):
+def get_next(iterator):
+    '''
+    Returns the next value of a list, deque, iterator or generator, or False
+    if there are no values left. Any other value is returned as it is.
+    '''
+    if isinstance(iterator, deque):
         try:
-            return iterator.pop(index)
+            return iterator.popleft()
         except IndexError:
             return False
-    elif isinstance(iterator, types.GeneratorType):
+    elif isinstance(iterator, list):
+        try:
+            return iterator.pop(0)
+        except IndexError:
+            return False
+    elif isinstance(iterator, Iterator):
         try:
             return next(iterator)
         except StopIteration:
@@ -76,10 +94,59 @@ def get_name(instance):
             return name
 
 
-def read_zip_file(zipfile):
-    content = ''
-    with ZipFile(BytesIO(zipfile)) as myzip:
-        for file_ in myzip.namelist():
-            with myzip.open(file_) as fle:
-                content += fle.read().decode('utf8')
-    return content
+def decompress(data, compression, encoding='utf8', chunk_size=0):
+    '''
+    Decompresses the data one member at a time, so only a single member of
+    an archive is held in memory.
+
+    Parameters
+    ----------
+    data : bytes or file
+           The compressed data, or a file opened in binary mode which is
+           closed when all members have been read.
+
+    compression : str
+                  One of "zip", "gzip", "bz2" or "xz".
+
+    chunk_size : int, optional
+                 If set, each member is read in chunks of lines of about this
+                 amount of characters, so a large member is not held in
+                 memory at once.
+
+    Yields
+    ------
+    tuple
+        The name and the decoded text of each member, or of each chunk of a
+        member. Gzip, bz2 and xz data consist of a single member without a
+        name.
+    '''
+    fileobj = BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    with closing(fileobj):
+        if compression == 'zip':
+            with ZipFile(fileobj) as archive:
+                for name in archive.namelist():
+                    with archive.open(name) as member:
+                        for text in read_member(
+                                TextIOWrapper(member, encoding), chunk_size):
+                            yield name, text
+        elif compression in decompressors:
+            with decompressors[compression](fileobj, 'rt',
+                                            encoding=encoding) as member:
+                for text in read_member(member, chunk_size):
+                    yield '', text
+        else:
+            raise ValueError('Unknown compression ' + str(compression))
+
+
+def read_member(member, chunk_size):
+    if not chunk_size:
+        yield member.read()
+        return
+    while True:
+        lines = member.readlines(chunk_size)
+        if not lines:
+            break
+        yield ''.join(lines)
+
+
+decompressors = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
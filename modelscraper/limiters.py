@@ -0,0 +1,157 @@
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from urllib import parse as urlparse
+import time
+
+
+class TokenBucket(object):
+    '''
+    A token bucket which allows "rate" requests per second with bursts of at
+    most "burst" requests.
+    '''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def reserve(self, limited=True):
+        '''
+        Take a token from the bucket. If limited is False, no token is taken
+        and only a block of the bucket is respected.
+
+        Returns
+        -------
+        float
+            0 if a token was taken, otherwise the amount of seconds until a
+            token will be available.
+        '''
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if not limited or not self.rate:
+            return 0
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until,
+                                 time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class DomainRateLimiter(object):
+    '''
+    Keeps a TokenBucket for each domain, so sources which request urls from
+    the same domain are rate limited together. A Scraper shares one
+    DomainRateLimiter between all of its sources. Each source passes its own
+    rate, a domain requested by several sources gets the lowest of their
+    rates.
+    '''
+
+    def __init__(self, rate=1, burst=1, rates={}, penalty=30):
+        '''
+        Parameters
+        ----------
+        rate : float, optional
+               The amount of requests per second for each domain. If set to 0,
+               the requests are not rate limited.
+
+        burst : int, optional
+                The amount of requests that can be made at once after a
+                domain has been idle.
+
+        rates : dict, optional
+                A mapping of domain to requests per second, which overrides
+                the rate for that domain.
+
+        penalty : int, optional
+                  The amount of seconds a domain is blocked when it responds
+                  with a 429 or 503 status without a Retry-After header.
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.rates = dict(rates)
+        self.penalty = penalty
+        self.buckets = {}
+        self.lock = Lock()
+
+    @classmethod
+    def combine(cls, limiters):
+        '''
+        Create a limiter that can be shared by the sources of the limiters.
+        The sources keep their own rates, only the rates of the domains and
+        the burst and penalty are combined.
+        '''
+        limiters = list(limiters)
+        limiter = cls(rate=0,
+                      burst=min(limiter.burst for limiter in limiters),
+                      penalty=max(limiter.penalty for limiter in limiters))
+        for other in limiters:
+            for domain, rate in other.rates.items():
+                limiter.rates[domain] = min(rate,
+                                            limiter.rates.get(domain, rate))
+        return limiter
+
+    @staticmethod
+    def domain(url):
+        return urlparse.urlparse(url).netloc
+
+    def domain_rate(self, domain, rate=None):
+        return self.rates.get(domain, self.rate if rate is None else rate)
+
+    def bucket(self, domain, rate):
+        bucket = self.buckets.get(domain)
+        if bucket is None:
+            bucket = self.buckets[domain] = TokenBucket(rate, self.burst)
+        elif rate and (not bucket.rate or rate < bucket.rate):
+            bucket.rate = rate
+        return bucket
+
+    def acquire(self, url, rate=None):
+        '''
+        Try to take a token for the domain of the url.
+
+        Parameters
+        ----------
+        rate : float, optional
+               The rate of the source which requests the url. Defaults to
+               the rate of the limiter. If it is 0, the request is only
+               delayed while the domain is blocked.
+
+        Returns
+        -------
+        float
+            0 if the request can be made, otherwise the amount of seconds
+            until the domain of the url has a token available.
+        '''
+        domain = self.domain(url)
+        rate = self.domain_rate(domain, rate)
+        with self.lock:
+            return self.bucket(domain, rate).reserve(bool(rate))
+
+    def retry_after(self, url, retry_after=None):
+        '''
+        Block the domain of the url for the amount of seconds in the value of
+        a Retry-After header, which can be either seconds or an HTTP date.
+        '''
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - \
+                    time.time()
+            except (TypeError, ValueError):
+                seconds = self.penalty
+        domain = self.domain(url)
+        with self.lock:
+            self.bucket(domain, self.domain_rate(domain)).block(
+                max(seconds, 0))
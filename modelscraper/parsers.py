@@ -1,6 +1,7 @@
 from datetime import datetime
+from io import BytesIO
+import copyreg
 import json
-import re
 import logging
 from functools import partial
 from urllib import parse as urlparse
@@ -8,13 +9,86 @@ from urllib import parse as urlparse
 import lxml.html as lxhtml
 import lxml.etree as etree
 from lxml.cssselect import CSSSelector
-from cssselect import SelectorSyntaxError
 
 # from scrapely import Scraper
 from jq import jq, _Program
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from .helpers import add_other_doc, wrap_list, format_docstring
-from .selectors import ORCSSSelector, JavascriptVarSelector
+from .selectors import ORCSSSelector, JavascriptVarSelector, \
+    compile_selector, compile_jq, compile_regex
+from .urls import PageRange
+
+
+copyreg.pickle(_Program, lambda program: (jq, (program.program_string,)))
+
+# orjson is used to decode JSON when it is installed, since it is a lot
+# faster than the json module.
+json_loads = orjson.loads if orjson else json.loads
+
+
+def iter_lines(data):
+    '''
+    Yields the lines in the data without splitting all of it at once. The
+    data can be a str, bytes or a file.
+    '''
+    if not isinstance(data, (str, bytes, bytearray)):
+        yield from data
+        return
+    newline = '\n' if isinstance(data, str) else b'\n'
+    start = 0
+    while start < len(data):
+        end = data.find(newline, start)
+        if end == -1:
+            end = len(data)
+        yield data[start:end]
+        start = end + 1
+
+
+class TextModifier(object):
+    '''
+    Applies the modifications described in BaseParser._modify_text to a text.
+    The options are checked and the regex is compiled once when the
+    TextModifier is created, so it can be reused for each value.
+    '''
+
+    def __init__(self, replacers=None, substitute='', regex='',
+                 numbers=False, template='', translation_table={}):
+        self.regex = compile_regex(regex) if type(regex) is str and regex \
+            else regex
+        self.replace = replacers and substitute
+        self.replacers = replacers
+        self.substitute = substitute
+        self.numbers = numbers
+        self.template = template
+        self.translation_table = translation_table
+
+    def __call__(self, text):
+        text = text.strip()
+        if self.regex:
+            try:
+                text = ''.join([found for found in
+                                self.regex.findall(text)])
+            except:
+                print('regex error', text)
+
+        if self.replace:
+            for key, subsitute in zip(self.replacers, self.substitute):
+                text = text.replace(key, self.substitute)
+
+        if self.translation_table:
+            text = text.translate(self.translation_table)
+
+        if self.numbers and any(map(str.isdecimal, text)):
+            text = int(''.join([c for c in text if c.isdecimal() and c]))
+
+        if self.template:
+            text = self.template.format(text)
+        return text
 
 
 class BaseParser(object):
@@ -26,7 +100,9 @@ class BaseParser(object):
 
     def select(self, selector=None, debug=False):
         selector = self._get_selector(selector)
-        return partial(self._select, selector=selector, debug=debug)
+        func = partial(self._select, selector=selector, debug=debug)
+        func.parser = self
+        return func
 
     def _select(self, url, data, selector=None, debug=False):
         data = self.convert_data(url, data)
@@ -80,27 +156,9 @@ class BaseParser(object):
         Order of occurence for the methods used by setting each parameter:
             regex -> replacers -> translation -> numbers -> template.
         '''
-        text = text.strip()
-        if regex:
-            regex = re.compile(regex)
-            try:
-                text = ''.join([found for found in regex.findall(text)])
-            except:
-                print('regex error', text)
-
-        if replacers and substitute:
-            for key, subsitute in zip(replacers, substitute):
-                text = text.replace(key, substitute)
-
-        if translation_table:
-            text = text.translate(translation_table)
-
-        if numbers and any(map(str.isdecimal, text)):
-            text = int(''.join([c for c in text if c.isdecimal() and c]))
-
-        if template:
-            text = template.format(text)
-        return text
+        return TextModifier(replacers=replacers, substitute=substitute,
+                            regex=regex, numbers=numbers, template=template,
+                            translation_table=translation_table)(text)
 
     def text(self, selector=None, **kwargs):
         """
@@ -113,18 +171,19 @@ class BaseParser(object):
                    The substitute used in the replacers parameter.
         """
         selector = self._get_selector(selector)
-        func = partial(self._text, selector=selector, **kwargs)
+        func = partial(self._text, selector=selector,
+                       modifier=TextModifier(**kwargs))
         func.parser = self
         return func
 
-    def _text(self, url, data, selector=None, index=None, **kwargs):
+    def _text(self, url, data, selector=None, index=None, modifier=None):
         '''
         Selects and modifies text.
         '''
         for element in self._select(url, data, selector):
             if element:
                 stripped = str(element).lstrip().rstrip()
-                yield self._modify_text(stripped, **kwargs)
+                yield modifier(stripped)
             else:
                 yield ''
 
@@ -134,12 +193,12 @@ class BaseParser(object):
         '''
         selector = self._get_selector(selector)
         func = partial(self._exists, selector=selector, key=key,
-                       **kwargs)
+                       modifier=TextModifier(**kwargs))
         func.parser = self
         return func
 
-    def _exists(self, url, data, selector=None, key='', **kwargs):
-        text = self._text(url, data, selector=selector, **kwargs)
+    def _exists(self, url, data, selector=None, key='', modifier=None):
+        text = self._text(url, data, selector=selector, modifier=modifier)
         if text:
             for t in text:
                 if key in t:
@@ -256,14 +315,7 @@ class HTMLParser(BaseParser):
             else:
                 assert type(selector) is str, \
                     "selector is not a string %r" % selector
-                try:
-                    return CSSSelector(selector)
-                except SelectorSyntaxError:
-                    try:
-                        return etree.XPath(selector)
-                    except etree.XPathSyntaxError:
-                        raise Exception('Not a valid css or xpath selector',
-                                        selector)
+                return compile_selector(selector)
 
     # TODO fix this
     '''
@@ -305,11 +357,11 @@ class HTMLParser(BaseParser):
 
         selector = self._get_selector(selector)
         func = partial(self._text, selector=selector, all_text=True,
-                       **kwargs)
+                       modifier=TextModifier(**kwargs))
         func.parser = self
         return func
 
-    def _text(self, url, data, selector=None, all_text=True, **kwargs):
+    def _text(self, url, data, selector=None, all_text=True, modifier=None):
         for element in self._select(url, data, selector):
             if type(element) in (lxhtml.HtmlElement, lxhtml.FormElement):
                 if all_text:
@@ -320,7 +372,7 @@ class HTMLParser(BaseParser):
                 text = element.text
             else:
                 text = element
-            yield self._modify_text(text, **kwargs)
+            yield modifier(text)
 
     def table(self, selector=None):
         selector = self._get_selector(selector)
@@ -349,15 +401,15 @@ class HTMLParser(BaseParser):
         '''
         selector = self._get_selector(selector)
         func = partial(self._attr, selector=selector, attr=attr,
-                       **kwargs)
+                       modifier=TextModifier(**kwargs))
         func.parser = self
         return func
 
-    def _attr(self, url, data, selector=None, attr='', **kwargs):
+    def _attr(self, url, data, selector=None, attr='', modifier=None):
         for element in self._select(url, data, selector):
             sel_attr = element.attrib.get(attr)
             if sel_attr:
-                yield self._modify_text(sel_attr, **kwargs)
+                yield modifier(sel_attr)
 
     @format_docstring(selector_doc=_HTMLParser_selector_doc)
     @add_other_doc(BaseParser._modify_text)
@@ -371,7 +423,8 @@ class HTMLParser(BaseParser):
                    {selector_doc}
         '''
         selector = self._get_selector(selector)
-        func = partial(self._attr, selector=selector, attr='href', **kwargs)
+        func = partial(self._attr, selector=selector, attr='href',
+                       modifier=TextModifier(**kwargs))
         func.parser = self
         return func
 
@@ -406,18 +459,65 @@ class HTMLParser(BaseParser):
         for element in self._select(url, data, selector):
             yield self._modify_text(lxhtml.tostring(element))
 
+    def iterparse(self, tag=None, html=False):
+        '''
+        Selects the elements with the tag while the data is being parsed,
+        instead of parsing the whole document first. Each element is cleared
+        as soon as the next one is selected, so the memory used stays the
+        same regardless of the size of the document. Use it as the selector
+        of a Model for large XML feeds or sitemaps, where each element is a
+        single record:
+
+        >>> product = Model(selector=htmlp.iterparse('product'), attrs=[
+            Attr(name='title', func=htmlp.text('title'))])
+
+        The objects parsed by such a Model are stored in chunks while the
+        data is still being parsed.
+
+        Parameters
+        ----------
+        tag : str or list of str, optional
+              The tag of the repeating record element. Namespaced tags are
+              written as "{namespace}tag".
+
+        html : bool, optional
+               Parse the data as HTML instead of XML.
+        '''
+        func = partial(self._iterparse, tag=tag, html=html)
+        func.parser = self
+        func.stream = True
+        return func
+
+    def _iterparse(self, url, data, tag=None, html=False):
+        if isinstance(data, str):
+            data = data.encode('utf8')
+        if isinstance(data, (bytes, bytearray)):
+            data = BytesIO(data)
+        try:
+            for event, element in etree.iterparse(data, tag=tag, html=html,
+                                                  recover=True):
+                yield element
+                element.clear()
+                # Remove the references from the parent to the elements that
+                # were already parsed.
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        except etree.XMLSyntaxError:
+            self.logger.exception('Unable to parse ' + str(url))
+
     def js_array(self, selector=None, var_name='', var_type=None):
         selector = self._get_selector(selector)
-        func = partial(self._js_array, selector=selector, var_name=var_name,
+        var_regex = 'var\s*'+var_name+'\s*=\s*(?:new Array\(|\[)(.*)(?:\)|\]);'
+        func = partial(self._js_array, selector=selector,
+                       modifier=TextModifier(regex=var_regex),
                        var_type=var_type)
         func.parser = self
         return func
 
-    def _js_array(self, url, data, selector=None, var_name='', var_type=None):
-        var_regex = 'var\s*'+var_name+'\s*=\s*(?:new Array\(|\[)(.*)(?:\)|\]);'
+    def _js_array(self, url, data, selector=None, modifier=None,
+                  var_type=None):
         for element in self._select(url, data, selector):
-            array_string = list(self._modify_text(element.text,
-                                                  regex=var_regex))
+            array_string = list(modifier(element.text))
             if array_string:
                 if var_type:
                     yield list(map(var_type, array_string[0].split(',')))
@@ -432,6 +532,9 @@ class HTMLParser(BaseParser):
                        per_page=per_page, url_template=url_template,
                        debug=debug)
         func.parser = self
+        # The source receives the pages as a PageRange, which generates the
+        # urls lazily, while the attr keeps the urls themselves.
+        func.url_pattern = partial(PageRange, url_template, 1)
         return func
 
     def _pagination(self, url, data, selector=None, per_page=None,
@@ -496,7 +599,7 @@ class JSONParser(BaseParser):
             return data
         elif data:
             try:
-                data = json.loads(data)
+                data = json_loads(data)
                 return data
             except Exception as E:
                 self.logger.exception(url + ' could not be loaded as json' +
@@ -515,7 +618,7 @@ class JSONParser(BaseParser):
             else:
                 assert type(selector) is str, "Selector must be str"
                 try:
-                    return jq(selector)
+                    return compile_jq(selector)
                 except:
                     self.logger.exception(str(selector) + 'cannot compile')
 
@@ -527,6 +630,52 @@ class JSONParser(BaseParser):
             return [data]
         return []
 
+    def iterparse(self, prefix='item', lines=False):
+        '''
+        Selects the records one at a time while the data is being parsed,
+        instead of loading all of the JSON first. Use it as the selector of a
+        Model for JSON Lines exports or large arrays of records. The objects
+        parsed by such a Model are stored in chunks while the data is still
+        being parsed.
+
+        Parameters
+        ----------
+        prefix : str, optional
+                 The ijson prefix of the records. "item" selects the items of
+                 an array at the top level, "results.item" selects the items
+                 of the array under the "results" key.
+
+        lines : bool, optional
+                If set to True, the data is read as JSON Lines, where each
+                line is a record. The prefix is ignored.
+        '''
+        func = partial(self._iterparse, prefix=prefix, lines=lines)
+        func.parser = self
+        func.stream = True
+        return func
+
+    def _iterparse(self, url, data, prefix='item', lines=False):
+        if lines:
+            for line in iter_lines(data):
+                if line.strip():
+                    try:
+                        yield json_loads(line)
+                    except ValueError:
+                        self.logger.warning(str(url) + ' contains a line ' +
+                                            'that is not json: ' + str(line))
+            return
+
+        import ijson
+
+        if isinstance(data, str):
+            data = data.encode('utf8')
+        if isinstance(data, (bytes, bytearray)):
+            data = BytesIO(data)
+        try:
+            yield from ijson.items(data, prefix, use_float=True)
+        except ijson.JSONError:
+            self.logger.exception(str(url) + ' could not be loaded as json')
+
     def dict(self, selector=None):
         selector = self._get_selector(selector)
         func = partial(self._dict, selector=selector)
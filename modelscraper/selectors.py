@@ -1,11 +1,48 @@
 import attr
 from lxml.cssselect import CSSSelector
 from cssselect import SelectorSyntaxError
+from functools import lru_cache
+from jq import jq
+import copyreg
 import lxml.etree as etree
 import re
 from .helpers import str_as_tuple
 
 
+# The compiled lxml selectors cannot be pickled, so they are pickled as the
+# string they were compiled from. This allows the parser functions of a Model
+# to be sent to the processes of a parse pool.
+copyreg.pickle(CSSSelector, lambda selector: (CSSSelector, (selector.css,)))
+copyreg.pickle(etree.XPath, lambda selector: (etree.XPath, (selector.path,)))
+
+
+# The same selectors and regular expressions are used by many models, so they
+# are compiled once for each process and shared.
+@lru_cache(maxsize=1024)
+def compile_selector(selector):
+    '''
+    Compiles a string into a CSSSelector, or into an XPath selector if it is
+    not a valid css selector.
+    '''
+    try:
+        return CSSSelector(selector)
+    except SelectorSyntaxError:
+        try:
+            return etree.XPath(selector)
+        except etree.XPathSyntaxError:
+            raise Exception('Not a valid css or xpath selector', selector)
+
+
+@lru_cache(maxsize=1024)
+def compile_jq(program):
+    return jq(program)
+
+
+@lru_cache(maxsize=1024)
+def compile_regex(regex):
+    return re.compile(regex)
+
+
 # TODO fix the TextSelector
 @attr.s
 class TextSelector:
@@ -46,18 +83,7 @@ class ORCSSSelector(object):
 
     def __init__(self, *args):
         assert len(args) > 1, "Add multiple selectors"
-        self.selectors = []
-        for selector in args:
-            try:
-                selector = CSSSelector(selector)
-                self.selectors.append(selector)
-            except SelectorSyntaxError:
-                try:
-                    selector = etree.XPath(selector)
-                    self.selectors.append(selector)
-                    print('xpath selector')
-                except etree.XpathSyntaxError:
-                    raise Exception('Not a valid selector')
+        self.selectors = [compile_selector(selector) for selector in args]
 
     def __call__(self, data):
         for selector in self.selectors:
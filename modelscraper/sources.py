@@ -1,9 +1,13 @@
+from queue import Empty, Queue
+
+import asyncio
 import os
 import time
-import subprocess
 import urllib
 import json
+import mmap
 import shutil
+import signal
 import string
 
 
@@ -13,8 +17,12 @@ import dns.resolver
 import requests
 
 
-from .components import BaseSource, BaseSourceWorker
+from .adapters import PoolingAdapter, pooled_session
+from .caches import DNSCache, HTTPCache
+from .components import BaseSource, BaseSourceWorker, AsyncSourceWorker
 from .helpers import add_other_doc, wrap_list, str_as_tuple
+from .limiters import DomainRateLimiter
+from .urls import UrlPattern, url_with_params
 
 
 class WebSourceWorker(BaseSourceWorker):
@@ -22,17 +30,82 @@ class WebSourceWorker(BaseSourceWorker):
     The Worker class for the WebSource. Largely a wrapper around the requests
     module.
     '''
+    def next_item(self):
+        '''
+        Get the next url from the in_q whose domain has a token available in
+        the rate limiter. Urls of domains without a token are put at the back
+        of the queue, so a worker only waits when none of the queued domains
+        can be requested. Urls with a fresh response in the cache are not
+        requested, so they do not need a token.
+        '''
+        skipped, wait = 0, None
+        while True:
+            item = self.in_q.get()
+            if item is None:
+                return item
+            if self.host_is_dead(item[0]):
+                self.drop(item)
+                continue
+            self.cached = self.cache_lookup(*item[:2])
+            if self.cached[2]:
+                return item
+            delay = self.parent.rate_limiter.acquire(item[0],
+                                                     self.parent.rate)
+            if not delay:
+                return item
+
+            self.in_q.put(item)
+            self.task_done(item)
+            skipped += 1
+            wait = min(delay, wait) if wait else delay
+            if skipped > self.in_q.qsize():
+                time.sleep(wait)
+                skipped, wait = 0, None
+
+    @property
+    def session(self):
+        return self.parent.session
+
+    def body(self, response):
+        # Compressed data is decompressed by the worker, so it is kept as
+        # bytes.
+        if self.parent.compression:
+            return response.content
+        return response.text
+
+    def cache_lookup(self, url, kwargs):
+        '''
+        Returns the key of the url in the cache, the cached entry and whether
+        the entry is fresh enough to be used without a request.
+        '''
+        cache = self.parent.cache
+        if not cache:
+            return None, None, False
+        key = cache.key(self.parent.func, url, kwargs)
+        return (key, *cache.lookup(key))
+
     def retrieve(self, url, kwargs):
-        time.sleep(self.parent.time_out)
         if self.parent.debug:
             print(self.__class__.__name__, url, kwargs)
+        cache = self.parent.cache
+        # The entry was already looked up by "next_item".
+        cached, self.cached = getattr(self, 'cached', None), None
+        if cache:
+            key, entry, fresh = cached or self.cache_lookup(url, kwargs)
+            if fresh:
+                return entry['body']
+            kwargs = cache.conditional_headers(entry, kwargs)
         try:
-            response = self.parent.session.request(self.parent.func, url,
-                                                   **kwargs)
-            if response:
-                return response.text
-            else:
-                return False
+            response = self.session.request(self.parent.func, url,
+                                            **kwargs)
+            if cache and entry and response.status_code == 304:
+                return cache.revalidate(key, entry)
+            elif response:
+                body = self.body(response)
+                if cache:
+                    cache.store(key, body, response)
+                return body
+            return self.failed(url, response)
 
         # Retry later with a timeout,
         except requests.Timeout:
@@ -40,21 +113,64 @@ class WebSourceWorker(BaseSourceWorker):
 
         # Retry later with connection error.
         except requests.ConnectionError:
-            # Check if the host is online or the DNS can be reached
-            try:
-                print('checking if the domain is up')
-                parsed = urllib.parse.urlparse(url)
-                dns.resolver.query(parsed.netloc)
+            if self.host_is_up(url):
                 self.logger.warning('Retrying url' + url)
-                time.sleep(self.parent.time_out)
+                self.parent.rate_limiter.retry_after(url,
+                                                     self.parent.time_out)
                 return False
-            except dns.resolver.Timeout:
-                return None
+            return None
 
         except Exception as E:
             self.logger.exception("Error retrieving the data from: " + url)
             return None
 
+    def failed(self, url, response):
+        '''
+        Returns False if the request for the url has to be retried, or None
+        if the url does not exist, like a page after the last page of a
+        PageRange.
+        '''
+        status = response.status_code
+        if status in (429, 503):
+            self.parent.rate_limiter.retry_after(
+                url, response.headers.get('Retry-After'))
+        elif status in (404, 410):
+            self.logger.warning('{} returned {}'.format(url, status))
+            return None
+        return False
+
+    def host_is_up(self, url):
+        '''
+        Check if the host is online or the DNS can be reached. A host that
+        could not be looked up in time is considered up, so its url is
+        retried instead of dropped.
+        '''
+        host = urllib.parse.urlparse(url).hostname
+        if self.parent.dns_cache:
+            addresses = self.parent.dns_cache.resolve(host)
+            return addresses is None or bool(addresses)
+        try:
+            print('checking if the domain is up')
+            dns.resolver.query(host)
+            return True
+        except dns.resolver.Timeout:
+            return False
+
+    def host_is_dead(self, url):
+        '''
+        Returns True if the DNS cache found that the host of the url could not
+        be resolved. The host is not looked up again.
+        '''
+        dns_cache = self.parent.dns_cache
+        return bool(dns_cache) and dns_cache.is_dead(
+            urllib.parse.urlparse(url).hostname)
+
+    def drop(self, item):
+        url, kwargs, attrs = item
+        self.logger.warning('Dropping ' + url + ', the host is down')
+        self.handle_data(url, kwargs, attrs, None)
+        self.task_done(item)
+
 
 class WebSource(BaseSource):
     '''
@@ -75,8 +191,9 @@ class WebSource(BaseSource):
     @add_other_doc(BaseSource.__init__, 'Parameters')
     def __init__(self, cookies=None, data=[], domain='', form=[],
                  func='get', headers={}, json_key='', params=[],
-                 session=requests.Session(), cache=False,
-                 time_out=1, user_agent=True, *args, **kwargs):
+                 session=None, pool_size=None, pool_hosts=10, dns_cache=True,
+                 cache=False, cache_ttl=3600, cache_size=2 ** 30, time_out=1,
+                 rate=None, burst=1, user_agent=True, *args, **kwargs):
         '''
         Parameters
         ----------
@@ -111,6 +228,24 @@ class WebSource(BaseSource):
                   >>> websource = WebSource()
                   >>> other_websource = WebSource(session=websource.session)
 
+        pool_size : int, optional
+                    The amount of connections kept alive for each host by the
+                    Session of this source. Defaults to the amount of workers,
+                    so each worker can reuse its own connection. Not used when
+                    a session is provided.
+
+        pool_hosts : int, optional
+                     The amount of hosts for which connections are kept alive
+                     by the Session of this source.
+
+        dns_cache : bool or DNSCache, optional
+                    Whether to cache the addresses of the hosts. New
+                    connections use the cached addresses and the urls of
+                    hosts that cannot be resolved are dropped without
+                    looking the host up again. A DNSCache can be given to
+                    share it between sources, in a Scraper the sources share
+                    a DNSCache by default.
+
         user_agent : bool or str, optional
                   If set to True a random UserAgent header will be added to
                   each request. If a string is provided, this string will be
@@ -118,11 +253,35 @@ class WebSource(BaseSource):
                   False, no UserAgent header will be added to the request.
 
         time_out : int, optional
-                   The amount of seconds that are in between each request made
-                   by a WebSourceWorker.
-
-        cache : bool, optional
-                Whether or not to using caching.
+                   The amount of seconds that each worker waits in between
+                   the requests it makes to the same domain.
+
+        rate : float, optional
+               The amount of requests per second made to the same domain by
+               all workers together. Defaults to "n_workers" requests per
+               "time_out" seconds, which is as fast as workers that each wait
+               "time_out" seconds. Set it to 0 to make requests as fast as
+               possible.
+
+        burst : int, optional
+                The amount of requests that can be made at once to a domain
+                that has been idle.
+
+                When the WebSource is used in a Scraper, the rate limiting is
+                shared with the other sources that make requests to the same
+                domain, which is requested at the lowest of their rates.
+
+        cache : bool, str or HTTPCache, optional
+                Whether or not to cache the responses. If a string is given,
+                it is used as the directory of the cache. An HTTPCache can be
+                given to share a cache between sources.
+
+        cache_ttl : int, optional
+                The amount of seconds a cached response is used before it is
+                revalidated with a conditional request.
+
+        cache_size : int, optional
+                The maximum size of the cache in bytes.
         '''
         super().__init__(*args, **kwargs)
         self.cookies = cookies
@@ -132,12 +291,40 @@ class WebSource(BaseSource):
         self.func = func.upper()
         self.headers = headers
         self.params = params
+        if dns_cache and not isinstance(dns_cache, DNSCache):
+            dns_cache = DNSCache()
+        self.dns_cache = dns_cache
+        if session is None:
+            session = pooled_session(pool_size or self.n_workers, pool_hosts,
+                                     dns_cache or None)
         self.session = session
         self.time_out = time_out
         self.user_agent = user_agent
-        if cache:
-            from diskcache import Cache
-            self.cache = Cache('/tmp/modelscraper_cache')
+        if rate is None:
+            rate = self.n_workers / time_out if time_out else 0
+        self.rate = rate
+        self.rate_limiter = DomainRateLimiter(rate=rate, burst=burst)
+        if cache and not isinstance(cache, HTTPCache):
+            directory = cache if type(cache) is str else \
+                '/tmp/modelscraper_cache'
+            cache = HTTPCache(directory, ttl=cache_ttl, size_limit=cache_size)
+        self.cache = cache
+
+    def use_dns_cache(self, dns_cache):
+        self.dns_cache = dns_cache
+        for adapter in getattr(self.session, 'adapters', {}).values():
+            if isinstance(adapter, PoolingAdapter):
+                adapter.dns_cache = dns_cache
+
+    def connection_stats(self):
+        '''
+        Returns the amount of connections opened by the Session of this source
+        and how many requests reused a kept alive connection.
+        '''
+        adapter = getattr(self.session, 'adapters', {}).get('https://')
+        if isinstance(adapter, PoolingAdapter):
+            return adapter.stats()
+        return {}
 
     def get_kwargs(self, objct=None):
         # Get the kwargs that might be obtained from the object if passed.
@@ -164,38 +351,201 @@ class WebSource(BaseSource):
         #                      if attr not in ('_url', 'url')}
         return kwargs
 
-    def add_source(self, url, attrs, objct):
-        kwargs = self.get_kwargs(objct)
+    def add_source(self, url, attrs, objct={}, re_insert=False):
+        if isinstance(url, UrlPattern):
+            return self.add_pattern(url, attrs)
 
+        # Most links found on a page are filtered out, so the url is checked
+        # before the kwargs, with a random User-Agent, are generated.
         if type(url) is str:
-            url = self.url_template.format(url)
+            if not re_insert:
+                url = self.url_template.format(url)
+            if self.url_regex and not self.url_regex(url):
+                return False
+            if self.domain and self.domain not in url:
+                return False
+
+        # The params are only part of the seen url when they are used.
+        if self.params:
+            kwargs = self.get_kwargs(objct)
+            key = url_with_params(url, kwargs.get('params'))
+            if key in self.seen and not re_insert:
+                return False
+        else:
+            key = url
+            if key in self.seen and not re_insert:
+                return False
+            kwargs = self.get_kwargs(objct)
 
-        prepared = requests.Request(self.func, url, **kwargs).prepare()
+        with self.lock:
+            self.to_parse += 1
+        self.in_q.put((url, kwargs, attrs))
+        self.add_to_seen(key)
 
-        if prepared.url not in self.seen:
-            if self.url_regex and not self.url_regex(url):
+
+class AsyncWebSourceWorker(AsyncSourceWorker, WebSourceWorker):
+    '''
+    The Worker class for the AsyncWebSource. It uses an httpx.AsyncClient to
+    keep many requests in flight from a single Thread.
+    '''
+
+    async def setup(self):
+        import httpx
+
+        self.httpx = httpx
+        self.host_slots = {}
+        self.client = httpx.AsyncClient(
+            follow_redirects=True, http2=self.parent.http2,
+            limits=httpx.Limits(
+                max_connections=self.parent.concurrency,
+                max_keepalive_connections=self.parent.concurrency))
+
+    async def teardown(self):
+        await self.client.aclose()
+
+    async def throttle(self, url):
+        '''
+        Wait until the rate limiter has a token for the domain of the url.
+        Only the request for this url waits, the other requests in flight
+        continue.
+        '''
+        rate_limiter = self.parent.rate_limiter
+        wait = rate_limiter.acquire(url, self.parent.rate)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = rate_limiter.acquire(url, self.parent.rate)
+
+    async def retrieve_async(self, url, kwargs):
+        if self.parent.debug:
+            print(self.__class__.__name__, url, kwargs)
+        host = urllib.parse.urlparse(url).netloc
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(self.parent.per_host)
+        if self.host_is_dead(url):
+            self.logger.warning('Dropping ' + url + ', the host is down')
+            return None
+
+        cache = self.parent.cache
+        if cache:
+            key, entry, fresh = self.cache_lookup(url, kwargs)
+            if fresh:
+                return entry['body']
+            kwargs = cache.conditional_headers(entry, kwargs)
+
+        async with self.host_slots[host]:
+            await self.throttle(url)
+            try:
+                response = await self.client.request(self.parent.func, url,
+                                                     **kwargs)
+                if cache and entry and response.status_code == 304:
+                    return cache.revalidate(key, entry)
+                elif response.status_code < 400:
+                    body = self.body(response)
+                    if cache:
+                        cache.store(key, body, response)
+                    return body
+                return self.failed(url, response)
+
+            # Retry later with a timeout,
+            except self.httpx.TimeoutException:
                 return False
 
-            if self.domain:
-                if self.domain not in url:
+            # Retry later with connection error.
+            except self.httpx.TransportError:
+                loop = asyncio.get_event_loop()
+                if await loop.run_in_executor(None, self.host_is_up, url):
+                    self.logger.warning('Retrying url' + url)
+                    self.parent.rate_limiter.retry_after(
+                        url, self.parent.time_out)
                     return False
-            self.in_q.put((url, kwargs, attrs))
-            self.to_parse += 1
-            self.add_to_seen(url)
+                return None
+
+
+class AsyncWebSource(WebSource):
+    '''
+    A WebSource which makes its requests from an asyncio event loop, so
+    thousands of requests can be in flight from a single worker. The amount
+    of requests in flight for each host is limited by the "per_host"
+    parameter, the rate of the requests by the "rate" parameter.
+    Requires the httpx package.
+    '''
+    source_worker = AsyncWebSourceWorker
+
+    @add_other_doc(WebSource.__init__, 'Parameters')
+    def __init__(self, concurrency=100, per_host=8, http2=False, *args,
+                 **kwargs):
+        '''
+        The requests are not rate limited by default, their amount is
+        limited by "concurrency" and "per_host" instead. Set the "rate"
+        parameter to limit the requests per second for each domain.
+
+        Parameters
+        ----------
+        concurrency : int, optional
+                      The maximum amount of requests in flight for each
+                      worker of this source.
+
+        per_host : int, optional
+                   The maximum amount of requests in flight to a single host.
+
+        http2 : bool, optional
+                Use HTTP/2 for the hosts that support it, so the requests to
+                a host are multiplexed over a single connection. Requires the
+                h2 package.
+        '''
+        kwargs.setdefault('rate', 0)
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.http2 = http2
 
 
 class BrowserSourceWorker(WebSourceWorker):
     '''Source worker for the BrowserSource. By setting the script parameter in
     the BrowserSource instance, the result of the script will be appended to
     the HTML as JSON with the root tag: "<script id='result'></script>"
+
+    Each worker has its own browser, which is started when the first url is
+    retrieved and restarted after every "recycle_after" pages.
     '''
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.browser = None
+        self.pages = 0
+
+    @property
+    def session(self):
+        recycle_after = self.parent.recycle_after
+        if self.browser is not None and recycle_after and \
+                self.pages >= recycle_after:
+            self.quit()
+        if self.browser is None:
+            self.browser = self.parent.start_browser()
+            self.pages = 0
+        return self.browser
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            self.quit()
+
+    def quit(self):
+        if self.browser is not None:
+            try:
+                self.browser.quit()
+            except Exception:
+                self.logger.exception('Could not quit the browser')
+            self.browser = None
+
     def retrieve(self, url, kwargs):
         response_text = super().retrieve(url, kwargs)
+        self.pages += 1
         if self.parent.script:
             if response_text:
                 try:
-                    script_result = self.parent.session.execute_script(
+                    script_result = self.browser.execute_script(
                         self.parent.script)
                     try:
                         script_result = json.dumps(script_result)
@@ -218,13 +568,23 @@ class BrowserSource(WebSource):
     A class that uses SeleniumBrowser module to visit an url and return its data.
     This class allows for the execution of Javascript code against a loaded DOM
     Tree. For now, only Firefox is supported.
+
+    Each worker of the source uses its own browser, so "n_workers" pages are
+    loaded at the same time.
     '''
     kwargs = ('data', 'form', 'params', 'cookies')
     source_worker = BrowserSourceWorker
 
+    # The Firefox preferences which stop the browser from loading images,
+    # stylesheets and fonts.
+    blocking_preferences = {'permissions.default.image': 2,
+                            'permissions.default.stylesheet': 2,
+                            'browser.display.use_document_fonts': 0}
+
     @add_other_doc(WebSource.__init__, 'Parameters')
     def __init__(self, browser='firefox', browser_executable='',
-                 script='', script_only=False, *args, **kwargs):
+                 script='', script_only=False, recycle_after=100,
+                 block_resources=True, *args, **kwargs):
         '''
         Parameters
         ----------
@@ -245,15 +605,24 @@ class BrowserSource(WebSource):
         script_only :  bool, optional
                        If set to True, only the result from the script is
                        returned as the data.
+
+        recycle_after : int, optional
+                        The amount of pages after which the browser of a
+                        worker is restarted, which frees the memory leaked by
+                        the browser. Set it to 0 to never restart the
+                        browsers.
+
+        block_resources : bool, optional
+                          If set to True, the browsers do not load images,
+                          stylesheets and fonts.
         '''
         self.script = script
         self.script_only = script_only
+        self.recycle_after = recycle_after
+        self.block_resources = block_resources
 
         assert browser.lower() == 'firefox', \
             'Please use only firefox  as the browser, more will be added later'
-        from selenium.webdriver.firefox.options import Options
-        from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
-        from seleniumrequests import Firefox as driver
 
         if not browser_executable:
             binary = os.popen('which ' + browser).read().strip()
@@ -261,26 +630,39 @@ class BrowserSource(WebSource):
             binary = browser_executable
         assert binary != '', 'The browser you chose was not ' + \
             'installed on the system'
-        binary = FirefoxBinary(binary)
+        self.binary = binary
+
+        super().__init__(session=False, *args, **kwargs)
+
+    def start_browser(self):
+        '''
+        Starts a headless browser, which is used by a single worker.
+        '''
+        from selenium.webdriver.firefox.options import Options
+        from seleniumrequests import Firefox as driver
 
         options = Options()
-        options.set_headless = True
+        options.binary_location = self.binary
         options.add_argument('--headless')
-
-        browser = driver(firefox_binary=binary, firefox_options=options)
-        super().__init__(session=browser, *args, **kwargs)
+        if self.block_resources:
+            for name, value in self.blocking_preferences.items():
+                options.set_preference(name, value)
+        return driver(options=options)
 
     def get_kwargs(self, objct=None):
         return super(WebSource, self).get_kwargs(objct)
 
-    def stop(self):
-        self.session.quit()
-        super().stop()
-
 
 class FileSourceWorker(BaseSourceWorker):
     def retrieve(self, url, kwargs):
         try:
+            if self.parent.compression:
+                # The file is decompressed while it is read by the worker.
+                return open(url, 'rb', **kwargs)
+            if self.parent.chunk_size:
+                # The chunks are read while they are put on the out_q,
+                # outside of the semaphore.
+                return self.read_chunks(open(url, 'rb', **kwargs))
             with open(url, **kwargs) as fle:
                 return fle.read()
         except FileNotFoundError:
@@ -290,6 +672,25 @@ class FileSourceWorker(BaseSourceWorker):
             self.logger.exception('Could not decode the result from ' + url)
             return False
 
+    def read_chunks(self, fle):
+        '''
+        Memory maps the file and yields it in chunks of about "chunk_size"
+        bytes, which end at a newline so no line is split between chunks.
+        '''
+        chunk_size = self.parent.chunk_size
+        with fle:
+            size = os.fstat(fle.fileno()).st_size
+            if not size:
+                return
+            with mmap.mmap(fle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start = 0
+                while start < size:
+                    end = data.find(b'\n', min(start + chunk_size, size) - 1)
+                    end = size if end == -1 else end + 1
+                    yield data[start:end].decode(self.parent.encoding,
+                                                 errors='replace')
+                    start = end
+
 
 class FileSource(BaseSource):
     '''
@@ -301,27 +702,89 @@ class FileSource(BaseSource):
     func = open
 
     @add_other_doc(BaseSource.__init__, 'Parameters')
-    def __init__(self, buffering=False, *args, **kwargs):
+    def __init__(self, buffering=False, encoding='utf8', max_chunks=100,
+                 *args, **kwargs):
+        '''
+        Parameters
+        ----------
+        encoding : str, optional
+                   The encoding used to decode the chunks.
+
+        max_chunks : int, optional
+                     The maximum amount of chunks waiting to be parsed. The
+                     workers wait with reading the next chunk until there is
+                     room, so only this amount of chunks is kept in memory.
+        '''
         super().__init__(*args, **kwargs)
         self.buffering = buffering
+        self.encoding = encoding
+        # Uncompressed files are memory mapped to read their chunks.
+        if self.chunk_size:
+            self.out_q = Queue(max_chunks)
 
 
-class ProgramSourceWorker(BaseSourceWorker):
-    def retrieve(self, url, kwargs):
-        print(kwargs)
-        function = '{} {} {}'.format(self.parent.func, self.parent.arguments,
-                                     str(url))
+class ProgramSourceWorker(AsyncSourceWorker):
+    '''
+    The Worker class for the ProgramSource. It runs the program for each url
+    as an asyncio subprocess, so many programs run at the same time from a
+    single worker.
+    '''
+
+    async def retrieve_async(self, url, kwargs):
+        command = '{} {} {}'.format(self.parent.func, self.parent.arguments,
+                                    str(url))
         if self.parent.debug:
-            self.logger.debug('Method to execute: ' + ' '.join(url))
-        result = subprocess.run(function, shell=True,
-                                stdout=subprocess.PIPE)
+            self.logger.debug('Method to execute: ' + command)
+        # The program gets its own process group, so the programs started by
+        # the shell are killed together with it.
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE, start_new_session=True)
+
+        if self.parent.stream_lines:
+            return self.stream_output(command, process)
+
         try:
-            data = result.stdout.decode('utf-8')
-            return data
-        except Exception as E:
-            self.logger.exception('Could not decode the result from ' +
-                                  function + ':\n ' + data)
-            return False
+            stdout, _ = await asyncio.wait_for(process.communicate(),
+                                               self.parent.time_out)
+        except asyncio.TimeoutError:
+            await self.kill(command, process)
+            return None
+        return stdout.decode('utf-8', errors='replace')
+
+    async def stream_output(self, command, process):
+        '''
+        Yields the output of the process in chunks of "stream_lines" lines,
+        while the process is still running.
+        '''
+        loop = asyncio.get_event_loop()
+        time_out = self.parent.time_out
+        deadline = loop.time() + time_out if time_out else None
+        lines = []
+        try:
+            while True:
+                remaining = deadline - loop.time() if deadline else None
+                line = await asyncio.wait_for(process.stdout.readline(),
+                                              remaining)
+                if not line:
+                    break
+                lines.append(line.decode('utf-8', errors='replace'))
+                if len(lines) >= self.parent.stream_lines:
+                    yield ''.join(lines)
+                    lines = []
+            await process.wait()
+        except asyncio.TimeoutError:
+            await self.kill(command, process)
+        if lines:
+            yield ''.join(lines)
+
+    async def kill(self, command, process):
+        self.logger.warning('Killing "{}" after {} seconds'.format(
+            command, self.parent.time_out))
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
 
 
 class ProgramSource(BaseSource):
@@ -333,7 +796,8 @@ class ProgramSource(BaseSource):
     kwargs = ['arguments']
 
     @add_other_doc(BaseSource.__init__, 'Parameters')
-    def __init__(self, arguments='', *args, **kwargs):
+    def __init__(self, arguments='', concurrency=10, time_out=None,
+                 stream_lines=0, *args, **kwargs):
         '''
         Parameters
         ----------
@@ -344,11 +808,27 @@ class ProgramSource(BaseSource):
 
         arguments : (list or tuple) of str
                     The arguments to be added to the program.
+
+        concurrency : int, optional
+                      The maximum amount of programs running at the same
+                      time for each worker of this source.
+
+        time_out : float, optional
+                   The amount of seconds after which a program is killed. By
+                   default the programs are not killed.
+
+        stream_lines : int, optional
+                       If set, the output of a program is parsed in chunks of
+                       this amount of lines while the program is running,
+                       instead of all at once when it has finished.
         '''
         super().__init__(*args, **kwargs)
-        assert self.func and isinstance(self.func, str), + \
+        assert self.func and isinstance(self.func, str), \
             'Please specify string as a function use with the ProgramSource.'
         self.arguments = arguments
+        self.concurrency = concurrency
+        self.time_out = time_out
+        self.stream_lines = stream_lines
 
         if shutil.which(self.func.split(' ')[0]) is None:
             raise Exception('The application that you specified is not ' +
@@ -397,31 +877,108 @@ class ModuleSource(BaseSource):
 
 
 class APISourceWorker(BaseSourceWorker):
-    def __init__(self, parent, *args, **kwargs):
-        super().__init__(parent, *args, **kwargs)
-        self.api_function = parent.api_function
-        self.batch = parent.batch
-
-    def retrieve_batch(self, urls):
-        return self.api_function(urls[0] if type(urls) == list else urls)
+    '''
+    The Worker class for the APISource. It takes up to "batch_size" urls from
+    the in_q and retrieves the data for all of them with a single call to the
+    api_function.
+    '''
 
     def run(self):
-        while True:
-            start = time.time()
-            url = self.in_q.get()
-            if url is None:
-                break
-            self.retrieving = True
-            data = self.retrieve(url)
-            # source = self.retrieve(self.in_q.get())
-            if data:
-                self.out_q.put(data)
-            self.visited += 1
-            self.total_time += time.time() - start
-            self.mean = self.total_time / self.visited
-            self.in_q.task_done()
+        stopping = False
+        while not stopping:
+            batch, stopping = self.next_batch()
+            if not batch:
+                continue
+
+            with self.semaphore:
+                self.retrieving = True
+                start = time.time()
+                results = self.retrieve_batch([url for url, _, _ in batch])
+
+            self._recalculate_mean(start)
+            for item, data in zip(batch, results):
+                self.handle_data(*item, data)
+                self.task_done(item)
             self.retrieving = False
 
+    def next_batch(self):
+        '''
+        Returns the items for the next call to the api_function and whether
+        the worker has to stop. It waits at most "max_wait" milliseconds
+        after the first item for the batch to fill up.
+        '''
+        item = self.in_q.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.time() + self.parent.max_wait / 1000
+        while len(batch) < self.parent.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.in_q.get(timeout=remaining)
+            except Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def retrieve_batch(self, urls):
+        '''
+        Calls the api_function with the list of urls and returns the data for
+        each url in the same order.
+        '''
+        if self.parent.debug:
+            print(self.__class__.__name__, urls)
+        try:
+            results = self.parent.api_function(urls)
+        except Exception:
+            self.logger.exception('Error retrieving the data from: ' +
+                                  str(urls))
+            return [None] * len(urls)
+
+        if isinstance(results, dict):
+            return [results.get(url) for url in urls]
+        results = list(results)
+        if len(results) != len(urls):
+            self.logger.error('The api_function returned {} results for {} '
+                              'urls'.format(len(results), len(urls)))
+            return [None] * len(urls)
+        return results
+
 
 class APISource(BaseSource):
+    '''
+    A Source which gets its data from a function that accepts a list of urls,
+    usually the ids for an API that can look up many ids with one request.
+    '''
     source_worker = APISourceWorker
+
+    @add_other_doc(BaseSource.__init__, 'Parameters')
+    def __init__(self, api_function=None, batch_size=1, max_wait=100, *args,
+                 **kwargs):
+        '''
+        Parameters
+        ----------
+        api_function : function
+                       Called with a list of urls. It returns either a dict
+                       with the data for each url, or a list with the data in
+                       the same order as the urls.
+
+        batch_size : int, optional
+                     The maximum amount of urls passed to a single call of
+                     the api_function.
+
+        max_wait : int, optional
+                   The amount of milliseconds a worker waits for more urls
+                   to fill a batch.
+        '''
+        super().__init__(*args, **kwargs)
+        assert callable(api_function), 'Please provide a callable as the ' + \
+            'api_function'
+        self.api_function = api_function
+        self.batch_size = batch_size
+        self.max_wait = max_wait
@@ -0,0 +1,184 @@
+from threading import Lock
+from urllib import parse as urlparse
+import itertools
+
+
+def canonical_url(url):
+    '''
+    Returns the url in a canonical form, so urls which point to the same
+    page are equal: the scheme and host are lowercased, the fragment is
+    removed and the query parameters are sorted. Urls which are not strings
+    are returned as they are.
+    '''
+    if type(url) is not str:
+        return url
+    # Most urls have no query or fragment, they only need a lowercased
+    # scheme and host.
+    if '?' not in url and '#' not in url:
+        scheme, separator, rest = url.partition('://')
+        if separator:
+            host, _, path = rest.partition('/')
+            return scheme.lower() + '://' + host.lower() + '/' + path
+        # Values such as ids, which are formatted into the url_template.
+        if ':' not in url and not url.startswith('//'):
+            return url or '/'
+    parsed = urlparse.urlsplit(url)
+    query = urlparse.urlencode(
+        sorted(urlparse.parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlparse.urlunsplit((parsed.scheme.lower(), parsed.netloc.lower(),
+                                parsed.path or '/', query, ''))
+
+
+def url_with_params(url, params):
+    '''
+    Returns the url with the params of a request added to its query, like the
+    url requests would retrieve.
+    '''
+    if not params or type(url) is not str:
+        return url
+    if type(params) not in (str, bytes):
+        params = urlparse.urlencode(params, doseq=True)
+    elif type(params) is bytes:
+        params = params.decode('utf8')
+    return url + ('&' if '?' in url else '?') + params
+
+
+class UrlPattern(object):
+    '''
+    Generates urls lazily by formatting a template with every combination of
+    the values of one or more iterables. It can be used as the urls of a
+    source, instead of a list with all the urls:
+
+    >>> WebSource(urls=UrlPattern('https://example.com/{}/{}',
+                                  range(2000, 2020), range(1, 13)))
+
+    The urls of a pattern are unique, so they are not added to the urls seen
+    by the source.
+    '''
+
+    def __init__(self, template, *values):
+        '''
+        Parameters
+        ----------
+        template : str
+                   A template which is formatted with str.format, with one
+                   value of each iterable.
+
+        values : iterable
+                 The iterables of which the values are placed in the
+                 template. Only the first iterable is read lazily, the others
+                 have to be finite.
+        '''
+        self.template = template
+        self.values = values
+        self.stopped = False
+        self.lock = Lock()
+        # itertools.product reads its iterables completely, which is avoided
+        # for the first iterable so it can be endless.
+        first, *others = values
+        self._values = ((value, *combination) for value in first
+                        for combination in itertools.product(*others))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            if self.stopped:
+                raise StopIteration
+            return self.template.format(*next(self._values))
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.template)
+
+    def stop(self):
+        '''
+        Stops generating urls.
+        '''
+        self.stopped = True
+
+    def ready(self, limit):
+        '''
+        Returns whether the next url can be generated, while at most "limit"
+        urls are retrieved at the same time by the source.
+        '''
+        return True
+
+    def queued(self, url):
+        '''
+        Called by the source with a generated url, as it is put in the queue
+        of the source after it was formatted with its url_template.
+        '''
+        pass
+
+    def parsed(self, url, amount):
+        '''
+        Called by the source with the amount of objects that were parsed from
+        the data of a url.
+        '''
+        pass
+
+
+class PageRange(UrlPattern):
+    '''
+    Generates the urls of numbered pages lazily. By default it stops after a
+    page from which no objects were parsed, so a range without an end can be
+    used when the amount of pages is unknown:
+
+    >>> WebSource(urls=PageRange('https://example.com/page/{}'))
+    '''
+
+    def __init__(self, template='{}', start=1, stop=None, step=1,
+                 stop_on_empty=True, prefetch=None):
+        '''
+        Parameters
+        ----------
+        template : str, optional
+                   A template in which the page number is placed.
+
+        start : int, optional
+                The first page.
+
+        stop : int, optional
+               The page at which to stop, which itself is not generated like
+               the stop of a range. If not set, pages are generated until a
+               page has no objects.
+
+        step : int, optional
+               The difference between each page number.
+
+        stop_on_empty : bool, optional
+                        Stop generating pages after a page from which no
+                        objects were parsed.
+
+        prefetch : int, optional
+                   The maximum amount of pages which are queued but not
+                   parsed yet, when stopping on an empty page. It limits the
+                   pages requested after the last page. Defaults to the
+                   amount of urls the source retrieves at the same time.
+        '''
+        assert stop is not None or stop_on_empty, \
+            'A PageRange without a stop has to stop on an empty page'
+        pages = itertools.count(start, step) if stop is None else \
+            range(start, stop, step)
+        super().__init__(template, pages)
+        self.stop_on_empty = stop_on_empty
+        self.prefetch = prefetch
+        # The queued pages which have not been parsed yet.
+        self.pages = {}
+
+    def ready(self, limit):
+        if self.stopped or not self.stop_on_empty:
+            return True
+        with self.lock:
+            return len(self.pages) < (self.prefetch or limit)
+
+    def queued(self, url):
+        with self.lock:
+            self.pages[url] = True
+
+    def parsed(self, url, amount):
+        with self.lock:
+            page = self.pages.pop(url, None)
+        if page and not amount and self.stop_on_empty:
+            self.stop()
@@ -0,0 +1,109 @@
+from unittest import mock
+import functools
+import http.server
+import sys
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from modelscraper.sources import BrowserSource
+
+
+class FakeBrowser(object):
+    '''
+    Stands in for the Selenium driver, it retrieves the pages with requests.
+    '''
+
+    def __init__(self):
+        self.threads = set()
+        self.urls = []
+        self.quitted = False
+
+    def request(self, method, url, **kwargs):
+        self.threads.add(threading.get_ident())
+        self.urls.append(url)
+        return requests.request(method, url, **kwargs)
+
+    def quit(self):
+        self.quitted = True
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class TestBrowserSource(unittest.TestCase):
+    pages = 10
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for i in range(cls.pages):
+            with open('{}/{}.html'.format(cls.directory.name, i), 'w') as fle:
+                fle.write('<html><body>{}</body></html>'.format(i))
+        handler = functools.partial(QuietHandler,
+                                    directory=cls.directory.name)
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.urls = ['http://127.0.0.1:{}/{}.html'.format(
+            cls.server.server_port, i) for i in range(cls.pages)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.directory.cleanup()
+
+    def retrieve(self, **kwargs):
+        browsers = []
+
+        def start_browser():
+            browsers.append(FakeBrowser())
+            return browsers[-1]
+
+        # Any existing file can be used as the executable, since the browser
+        # is not started.
+        source = BrowserSource(browser_executable=sys.executable, time_out=0,
+                               dns_cache=False, **kwargs)
+        with mock.patch.object(source, 'start_browser', start_browser):
+            source.start()
+            results = []
+            while True:
+                result = source.get_source()
+                if result is False:
+                    break
+                if result:
+                    results.append(result)
+        return source, browsers, results
+
+    def test_browser_is_started_lazily(self):
+        source, browsers, results = self.retrieve(n_workers=2)
+        self.assertEqual(browsers, [])
+        self.assertEqual(results, [])
+
+    def test_one_browser_per_worker(self):
+        source, browsers, results = self.retrieve(
+            urls=self.urls, n_workers=2, recycle_after=0)
+        self.assertEqual(len(results), self.pages)
+        self.assertLessEqual(len(browsers), 2)
+        # A browser is only used by the worker which started it.
+        for browser in browsers:
+            self.assertEqual(len(browser.threads), 1)
+            self.assertTrue(browser.quitted)
+        self.assertEqual(sorted(url for browser in browsers
+                                for url in browser.urls), sorted(self.urls))
+
+    def test_browser_is_recycled(self):
+        source, browsers, results = self.retrieve(
+            urls=self.urls, n_workers=1, recycle_after=3)
+        self.assertEqual(len(results), self.pages)
+        self.assertEqual([len(browser.urls) for browser in browsers],
+                         [3, 3, 3, 1])
+        self.assertTrue(all(browser.quitted for browser in browsers))
+
+
+if __name__ == '__main__':
+    unittest.main()